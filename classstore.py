@@ -0,0 +1,312 @@
+import sys
+import os
+import re
+import time
+import json
+from get_classes import progressbar, codeblock, clonepair, lines_in_file
+
+helpmsg = \
+'''
+Usage: python classstore.py add [-d delta] <store> <input1> ... <inputN>
+       python classstore.py export <store> <output>
+
+Хранилище классов клонов, которое можно дополнять новыми парами клонов
+без пересчёта всех классов заново.
+
+add: добавляет пары клонов из input1, ..., inputN в хранилище store
+(директория создаётся, если её нет). Блоки кода и классы находятся так
+же, как в get_classes.py. В хранилище сохраняются вершины, блоки кода
+по файлам, состояние системы непересекающихся множеств и файл классов
+classes.txt, в который дописываются только изменившиеся классы (после
+сжатия устаревших строк он называется classes.N.txt). Вершины,
+объединения классов и положения строк классов в classes.txt только
+дописываются в файлы vertices.txt, unions.txt и lines.txt, а их
+сохранённые размеры хранятся в небольшом header.json, поэтому add
+записывает только новые данные. Если
+указан delta, в него выводятся изменившиеся классы в формате
+new|grown|merged<TAB>{dir,file,start,end;...}:
+- new: класс только из новых блоков кода;
+- grown: в существующий класс добавились новые блоки кода;
+- merged: несколько существующих классов объединились в один.
+
+export: выводит в output все текущие классы в формате get_classes.py.
+'''
+
+class classstore:
+    def __init__(self, path: str):
+        self.path = path
+        self.vertices = []
+        self.files = {}
+        self.parent = []
+        # Blocks of every class, by its root
+        self.members = {}
+        # Offset and length of the current line of every class in classes.txt, by its root
+        self.lines = {}
+        # classes.txt and lines.txt get new names on every compaction, the old ones are removed after the header is saved
+        self.log_name = 'classes.txt'
+        self.lines_name = 'lines.txt'
+        self.generation = 0
+        self.log_size = 0
+        self.dead = 0
+        self.total_edges = 0
+        # Saved sizes of the files, which are only appended to, and their records, which are not saved yet
+        self.sizes = {'vertices': 0, 'unions': 0, 'lines': 0}
+        self.pending = {'vertices': [], 'unions': [], 'lines': []}
+    
+    def header_fn(self):
+        return os.path.join(self.path, 'header.json')
+    
+    def log_fn(self):
+        return os.path.join(self.path, self.log_name)
+    
+    def record_fns(self):
+        names = {'vertices': 'vertices.txt', 'unions': 'unions.txt', 'lines': self.lines_name}
+        return {kind: os.path.join(self.path, name) for kind, name in names.items()}
+    
+    def remove_old_logs(self):
+        # Only files of other compactions: classes.txt, classes.<N>.txt, lines.txt and lines.<N>.txt
+        for fn in os.listdir(self.path):
+            if re.fullmatch(r'(classes|lines)(\.\d+)?\.txt', fn) and fn not in (self.log_name, self.lines_name):
+                os.remove(os.path.join(self.path, fn))
+    
+    @classmethod
+    def load(cls, path: str):
+        store = cls(path)
+        if os.path.exists(store.header_fn()):
+            with open(store.header_fn(), "r") as f:
+                store.__dict__.update(json.load(f))
+        else:
+            os.makedirs(path, exist_ok=True)
+        # Records, lines and compacted files written after the last saved header are not counted, e.g. after a crash
+        store.remove_old_logs()
+        for kind, fn in store.record_fns().items():
+            with open(fn, "a") as f:
+                f.truncate(store.sizes[kind])
+        with open(store.log_fn(), "a") as f:
+            f.truncate(store.log_size)
+        store.read_records()
+        return store
+    
+    def read_records(self):
+        fns = self.record_fns()
+        with open(fns['vertices'], "r") as f:
+            self.vertices = [codeblock(fn, int(begin), int(end)) for fn, begin, end in
+                             (line.rsplit(',', 2) for line in f)]
+        self.parent = list(range(len(self.vertices)))
+        self.members = {v: [v] for v in self.parent}
+        for v, cb in enumerate(self.vertices):
+            self.files.setdefault(cb.fn, []).append(v)
+        with open(fns['unions'], "r") as f:
+            for line in f:
+                r2, r1 = line.split(',')
+                self.join(int(r1), int(r2), False)
+        with open(fns['lines'], "r") as f:
+            for line in f:
+                fields = line.split(',')
+                if len(fields) == 1:
+                    del self.lines[int(fields[0])]
+                else:
+                    self.lines[int(fields[0])] = (int(fields[1]), int(fields[2]))
+    
+    def save(self):
+        for kind, fn in self.record_fns().items():
+            with open(fn, "a") as f:
+                f.writelines(self.pending[kind])
+            self.pending[kind] = []
+            self.sizes[kind] = os.path.getsize(fn)
+        header = {key: getattr(self, key) for key in ('log_name', 'lines_name', 'generation', 'log_size', 'dead',
+                                                      'total_edges', 'sizes')}
+        tfn = self.header_fn() + '.tmp'
+        with open(tfn, "w") as f:
+            json.dump(header, f)
+        os.replace(tfn, self.header_fn())
+        self.remove_old_logs()
+    
+    def find(self, v: int):
+        while self.parent[v] != v:
+            self.parent[v] = self.parent[self.parent[v]]
+            v = self.parent[v]
+        return v
+    
+    def union(self, v1: int, v2: int):
+        r1, r2 = self.find(v1), self.find(v2)
+        if r1 == r2:
+            return
+        if len(self.members[r1]) < len(self.members[r2]):
+            r1, r2 = r2, r1
+        self.join(r1, r2)
+    
+    def join(self, r1: int, r2: int, record: bool = True):
+        self.parent[r2] = r1
+        self.members[r1].extend(self.members.pop(r2))
+        if record:
+            self.pending['unions'].append(f'{r2},{r1}\n')
+    
+    def find_copy(self, cb: codeblock):
+        if cb.fn not in self.files:
+            return None
+        for u in self.files[cb.fn]:
+            if codeblock.intersect(cb, self.vertices[u], 0.7):
+                return u
+        return None
+    
+    def add_vertex(self, cb: codeblock, record: bool = True):
+        v = len(self.vertices)
+        self.vertices.append(cb)
+        self.parent.append(v)
+        self.members[v] = [v]
+        self.files.setdefault(cb.fn, []).append(v)
+        if record:
+            self.pending['vertices'].append(cb.__repr__() + '\n')
+        return v
+    
+    def insert_edge(self, cp: clonepair, created: list[int], affected: set[int]):
+        self.total_edges += 1
+        ends = []
+        for cb in (cp.b1, cp.b2):
+            v = self.find_copy(cb)
+            if v is None:
+                v = self.add_vertex(cb)
+                created.append(v)
+            else:
+                # Until the first change the class of v still has its root from classes.txt
+                r = self.find(v)
+                if r in self.lines:
+                    affected.add(r)
+            ends.append(v)
+        self.union(*ends)
+    
+    def class_line(self, r: int):
+        return '{' + ';'.join([self.vertices[v].__repr__() for v in self.members[r]]) + '}\n'
+    
+    def changed_classes(self, created: list[int], affected: set[int]):
+        grown = {self.find(v) for v in created}
+        old = {}
+        for r in affected:
+            old.setdefault(self.find(r), []).append(r)
+        changes = []
+        for r in grown | set(old):
+            if r not in old:
+                changes.append((r, 'new', []))
+            elif len(old[r]) > 1:
+                changes.append((r, 'merged', old[r]))
+            elif r in grown:
+                changes.append((r, 'grown', old[r]))
+        return changes
+    
+    def rewrite(self, changes: list[tuple], delta):
+        with open(self.log_fn(), "a") as f:
+            for r, status, old in changes:
+                for o in old:
+                    self.dead += self.lines.pop(o)[1]
+                    self.pending['lines'].append(f'{o}\n')
+                line = self.class_line(r)
+                size = len(line.encode())
+                self.lines[r] = (self.log_size, size)
+                self.pending['lines'].append(f'{r},{self.log_size},{size}\n')
+                self.log_size += size
+                f.write(line)
+                if delta is not None:
+                    delta.write(f'{status}\t{line}')
+        if self.dead > self.log_size - self.dead:
+            self.compact()
+    
+    def compact(self):
+        # Drop outdated lines, when they take more than a half of classes.txt.
+        # The old files stay until save, so the saved header always points to whole files
+        self.generation += 1
+        log_name = f'classes.{self.generation}.txt'
+        lines = {}
+        offset = 0
+        with open(self.log_fn(), "rb") as f, open(os.path.join(self.path, log_name), "wb") as of:
+            for r, (start, size) in sorted(self.lines.items(), key=lambda x: x[1][0]):
+                f.seek(start)
+                of.write(f.read(size))
+                lines[r] = (offset, size)
+                offset += size
+        self.log_name = log_name
+        self.lines = lines
+        self.log_size = offset
+        self.dead = 0
+        # Positions of lines in the new file go to a new lines.txt as a whole
+        self.lines_name = f'lines.{self.generation}.txt'
+        self.sizes['lines'] = 0
+        self.pending['lines'] = [f'{r},{start},{size}\n' for r, (start, size) in lines.items()]
+    
+    def export(self, ofn: str):
+        with open(self.log_fn(), "rb") as f, open(ofn, "wb") as of:
+            for start, size in sorted(self.lines.values()):
+                f.seek(start)
+                of.write(f.read(size))
+
+def add(path: str, ifns: list[str], dfn: str):
+    start = time.time()
+    
+    print("Loading store... ", end="")
+    sys.stdout.flush()
+    store = classstore.load(path)
+    print("done.")
+    
+    total_lines = sum(lines_in_file(fn) for fn in ifns)
+    current_line = 0
+    progress = progressbar(max(total_lines, 1), current_line)
+    created = []
+    affected = set()
+    for fn in ifns:
+        with open(fn, "r") as f:
+            for line in f:
+                current_line += 1
+                progress.update(current_line)
+                store.insert_edge(clonepair(line.rstrip()), created, affected)
+    progress.end()
+    
+    print("Writing changed classes... ", end="")
+    sys.stdout.flush()
+    changes = store.changed_classes(created, affected)
+    with open(dfn or os.devnull, "w") as delta:
+        store.rewrite(changes, delta if dfn else None)
+    store.save()
+    print("done.")
+    
+    print(f'total classes:\t{len(store.lines)}')
+    print(f'new classes:\t{sum(1 for c in changes if c[1] == "new")}')
+    print(f'grown classes:\t{sum(1 for c in changes if c[1] == "grown")}')
+    print(f'merged classes:\t{sum(1 for c in changes if c[1] == "merged")} (from {sum(len(c[2]) for c in changes if c[1] == "merged")})')
+    print(f'original number of pairs:\t{store.total_edges}')
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+
+def export(path: str, ofn: str):
+    if not os.path.exists(os.path.join(path, 'header.json')):
+        print(f'No class store in "{path}".')
+        exit(0)
+    store = classstore.load(path)
+    store.export(ofn)
+    print(f'total classes:\t{len(store.lines)}')
+
+def help():
+    print(helpmsg)
+    exit(0)
+
+def main():
+    if len(sys.argv) < 2:
+        help()
+    command = sys.argv[1]
+    dfn = None
+    args = []
+    i = 2
+    while (i < len(sys.argv)):
+        if sys.argv[i] == '-d':
+            i += 1
+            dfn = sys.argv[i]
+        else:
+            args.append(sys.argv[i])
+        i += 1
+    if command == 'add' and len(args) >= 2:
+        add(args[0], args[1:], dfn)
+    elif command == 'export' and len(args) == 2:
+        export(args[0], args[1])
+    else:
+        help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import sys
+import os
+import time
+import json
+import mmap
+import array
+import struct
+import bisect
+
+helpmsg = \
+'''
+Usage: python index.py build [-c classes] <input> <index>
+       python index.py query [-c] <index> <dir,file> [line | start-end]
+
+build: строит в директории index индекс по файлу пар клонов input
+(например, выводу shrink.py) и, если указан, по файлу классов classes
+(выводу get_classes.py). Для каждого файла исходного кода индекс
+хранит блоки кода, отсортированные по началу, и смещения строк в input
+и classes, в которых эти блоки встречаются.
+
+query: выводит пары клонов (или классы, с флагом -c), в которых есть
+блок кода из файла dir,file, содержащий строку line или пересекающийся
+с отрезком строк start-end. Без line выводятся все пары (классы) для
+этого файла. Индекс читается через mmap, целиком не загружается.
+'''
+
+# begin, end, max end of this and all previous blocks of the file, offset of the line
+entry = struct.Struct('<iiiq')
+
+class blockindex:
+    def __init__(self, fn: str):
+        self.file = open(fn, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(fn) > 0 else b''
+    
+    def __getitem__(self, i: int):
+        return entry.unpack_from(self.mm, i * entry.size)
+    
+    def close(self):
+        if self.mm:
+            self.mm.close()
+        self.file.close()
+
+class beginview:
+    # Begins of blocks from start to start + count, for bisect
+    def __init__(self, index: blockindex, start: int, count: int):
+        self.index = index
+        self.start = start
+        self.count = count
+    
+    def __len__(self):
+        return self.count
+    
+    def __getitem__(self, i: int):
+        return self.index[self.start + i][0]
+    
+    def overlapping(self, first: int, last: int):
+        # Blocks with begin <= last and end >= first; max end stops the scan
+        offsets = []
+        i = bisect.bisect_right(self, last) - 1
+        while i >= 0:
+            begin, end, maxend, offset = self.index[self.start + i]
+            if maxend < first:
+                break
+            if end >= first:
+                offsets.append(offset)
+            i -= 1
+        return offsets
+    
+    def all(self):
+        return [self.index[self.start + i][3] for i in range(self.count)]
+
+def add_block(blocks: dict, fn: str, begin: int, end: int, offset: int):
+    if fn not in blocks:
+        blocks[fn] = array.array('q')
+    blocks[fn].extend((begin, end, offset))
+
+def collect_pairs(ifn: str):
+    blocks = {}
+    offset = 0
+    with open(ifn, "rb") as f:
+        for line in f:
+            fields = line.rstrip().decode().split(',')
+            if len(fields) >= 8:
+                add_block(blocks, f'{fields[0]},{fields[1]}', int(fields[2]), int(fields[3]), offset)
+                add_block(blocks, f'{fields[4]},{fields[5]}', int(fields[6]), int(fields[7]), offset)
+            offset += len(line)
+    return blocks
+
+def collect_classes(cfn: str):
+    blocks = {}
+    offset = 0
+    with open(cfn, "rb") as f:
+        for line in f:
+            for cb in line.decode().strip().strip('{}').split(';'):
+                fields = cb.split(',')
+                if len(fields) == 4:
+                    add_block(blocks, f'{fields[0]},{fields[1]}', int(fields[2]), int(fields[3]), offset)
+            offset += len(line)
+    return blocks
+
+def write_blocks(blocks: dict, names: list[str], ofn: str):
+    ranges = {}
+    start = 0
+    with open(ofn, "wb") as f:
+        for name in names:
+            flat = blocks.get(name)
+            if flat is None:
+                ranges[name] = (0, 0)
+                continue
+            triples = sorted(zip(flat[0::3], flat[1::3], flat[2::3]))
+            maxend = None
+            for begin, end, offset in triples:
+                maxend = end if maxend is None else max(maxend, end)
+                f.write(entry.pack(begin, end, maxend, offset))
+            ranges[name] = (start, len(triples))
+            start += len(triples)
+    return ranges
+
+def build(ifn: str, cfn: str, index: str):
+    start = time.time()
+    os.makedirs(index, exist_ok=True)
+    
+    print("Indexing clone pairs... ", end="")
+    sys.stdout.flush()
+    pairs = collect_pairs(ifn)
+    print("done.")
+    classes = {}
+    if cfn is not None:
+        print("Indexing classes... ", end="")
+        sys.stdout.flush()
+        classes = collect_classes(cfn)
+        print("done.")
+    
+    print("Writing index... ", end="")
+    sys.stdout.flush()
+    names = sorted(set(pairs) | set(classes))
+    pair_ranges = write_blocks(pairs, names, os.path.join(index, 'pairs.bin'))
+    class_ranges = write_blocks(classes, names, os.path.join(index, 'classes.bin'))
+    with open(os.path.join(index, 'files.txt'), "w") as f:
+        for name in names:
+            f.write(f'{name}\t{pair_ranges[name][0]}\t{pair_ranges[name][1]}\t{class_ranges[name][0]}\t{class_ranges[name][1]}\n')
+    meta = {
+        'pairs': os.path.abspath(ifn),
+        'pairs_size': os.path.getsize(ifn),
+        'classes': os.path.abspath(cfn) if cfn is not None else None,
+        'classes_size': os.path.getsize(cfn) if cfn is not None else None,
+    }
+    with open(os.path.join(index, 'meta.json'), "w") as f:
+        json.dump(meta, f)
+    print("done.")
+    print(f'files:\t{len(names)}')
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+
+def find_file(index: str, name: str):
+    # files.txt is sorted by name, so only the matching line is parsed
+    fn = os.path.join(index, 'files.txt')
+    if os.path.getsize(fn) == 0:
+        # Index of an empty input, an empty file can't be mapped
+        return None
+    with open(fn, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        key = name.encode() + b'\t'
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = mm.rfind(b'\n', 0, mid) + 1
+            line_end = mm.find(b'\n', line_start)
+            line = mm[line_start:line_end]
+            if line.startswith(key):
+                fields = line.decode().split('\t')
+                mm.close()
+                return (int(fields[1]), int(fields[2])), (int(fields[3]), int(fields[4]))
+            if line < key:
+                lo = line_end + 1
+            else:
+                hi = line_start
+        mm.close()
+    return None
+
+def print_lines(fn: str, offsets: list[int]):
+    with open(fn, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for offset in sorted(set(offsets)):
+            end = mm.find(b'\n', offset)
+            print(mm[offset:end if end >= 0 else len(mm)].decode())
+        mm.close()
+
+def query(index: str, name: str, lines: str, classes: bool):
+    with open(os.path.join(index, 'meta.json'), "r") as f:
+        meta = json.load(f)
+    kind = 'classes' if classes else 'pairs'
+    if meta[kind] is None:
+        print("Index was built without classes.")
+        exit(0)
+    if os.path.getsize(meta[kind]) != meta[kind + '_size']:
+        print(f'Warning: "{meta[kind]}" was changed after building the index.', file=sys.stderr)
+    
+    ranges = find_file(index, name)
+    if ranges is None:
+        return
+    start, count = ranges[1] if classes else ranges[0]
+    blocks = blockindex(os.path.join(index, kind + '.bin'))
+    view = beginview(blocks, start, count)
+    if lines is None:
+        offsets = view.all()
+    else:
+        first, _, last = lines.partition('-')
+        offsets = view.overlapping(int(first), int(last or first))
+    print_lines(meta[kind], offsets)
+    blocks.close()
+
+def help():
+    print(helpmsg)
+    exit(0)
+
+def main():
+    if len(sys.argv) < 2:
+        help()
+    command = sys.argv[1]
+    classes = None
+    args = []
+    i = 2
+    while (i < len(sys.argv)):
+        if sys.argv[i] == '-c':
+            if command == 'build':
+                i += 1
+                classes = sys.argv[i]
+            else:
+                classes = True
+        else:
+            args.append(sys.argv[i])
+        i += 1
+    if command == 'build' and len(args) == 2:
+        build(args[0], classes, args[1])
+    elif command == 'query' and len(args) in (2, 3):
+        query(args[0], args[1], args[2] if len(args) == 3 else None, bool(classes))
+    else:
+        help()
+
+if __name__ == "__main__":
+    main()
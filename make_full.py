@@ -2,11 +2,17 @@ import sys
 import disjoint_set
 
 '''
-Usage: python make_full.py <input1> ... <inputN> <output>
+Usage: python make_full.py [--new-only] <input1> ... <inputN> <output>
 
 Найти компоненты связности в графе пар клонов из объединения 
 файлов input1, ..., inputN, и дополнить их до полных подграфов, 
 записав получившийся набор пар клонов в output
+
+С флагом --new-only в output записываются только добавленные пары
+клонов, которых нет во входных файлах, а в output.classes для каждого
+класса выводится строка index<TAB>dir,file,start,end<TAB>size<TAB>added:
+номер класса и его первый блок кода, по которым класс можно найти,
+число блоков кода и число добавленных пар.
 '''
 
 class progressbar:
@@ -43,9 +49,6 @@ class codeblock:
         self.begin = begin
         self.end = end
     
-    def equal(self, cb):
-        return self.fn == cb.fn and self.begin == cb.begin and self.end == cb.end
-    
     def __repr__(self):
         return f'{self.fn},{self.begin},{self.end}'
     
@@ -65,6 +68,13 @@ class clonepair:
         self.b1 = codeblock(f'{dir1},{fn1}', int(begin1), int(end1))
         self.b2 = codeblock(f'{dir2},{fn2}', int(begin2), int(end2))
     
+    @classmethod
+    def from_row(cls, fn1: str, begin1: int, end1: int, fn2: str, begin2: int, end2: int):
+        cp = cls.__new__(cls)
+        cp.b1 = codeblock(fn1, begin1, end1)
+        cp.b2 = codeblock(fn2, begin2, end2)
+        return cp
+    
     def __repr__(self):
         return f'{self.b1.__repr__()},{self.b2.__repr__()}'
     
@@ -83,19 +93,19 @@ class vertex:
         self.parent = index
 
 class clonegraph:
-    def __init__(self):
+    def __init__(self, keep_edges: bool = False):
         self.vertices = []
-        self.files = {}
+        self.blocks = {}
         self.classes = disjoint_set.DisjointSet()
         self.total_edges = 0
+        # Input edges as pairs of vertex indices packed in one int, if needed
+        self.edges = set() if keep_edges else None
     
     def find_copy(self, cb: codeblock):
-        if cb.fn not in self.files:
+        u = self.blocks.get((cb.fn, cb.begin, cb.end))
+        if u is None:
             return None
-        for u in self.files[cb.fn]:
-            if cb.equal(self.vertices[u].cb):
-                return self.vertices[u]
-        return None
+        return self.vertices[u]
     
     def insert_edge(self, cp: clonepair):
         self.total_edges += 1
@@ -104,18 +114,14 @@ class clonegraph:
         if v1 is None:
             v1 = vertex(cp.b1, len(self.vertices))
             self.vertices.append(v1)
-            if v1.cb.fn in self.files:
-                self.files[v1.cb.fn].append(v1.index)
-            else:
-                self.files[v1.cb.fn] = [v1.index]
+            self.blocks[(v1.cb.fn, v1.cb.begin, v1.cb.end)] = v1.index
         if v2 is None:
             v2 = vertex(cp.b2, len(self.vertices))
             self.vertices.append(v2)
-            if v2.cb.fn in self.files:
-                self.files[v2.cb.fn].append(v2.index)
-            else:
-                self.files[v2.cb.fn] = [v2.index]
+            self.blocks[(v2.cb.fn, v2.cb.begin, v2.cb.end)] = v2.index
         self.classes.union(v1.index, v2.index)
+        if self.edges is not None:
+            self.edges.add(edge_key(v1.index, v2.index))
         
     def write_classes(self, fn: str):
         with open(fn, "w") as f:
@@ -131,6 +137,28 @@ class clonegraph:
                         v1 = self.vertices[cl[i]].cb
                         v2 = self.vertices[cl[j]].cb
                         f.write(f'{v1},{v2}\n')
+    
+    def new_to_file(self, fn: str):
+        added = []
+        with open(fn, "w") as f, open(fn + '.classes', "w") as cf:
+            for index, c in enumerate(self.classes.itersets()):
+                cl = list(c)
+                count = 0
+                for i in range(len(cl)):
+                    for j in range(i):
+                        if edge_key(cl[i], cl[j]) in self.edges:
+                            continue
+                        v1 = self.vertices[cl[i]].cb
+                        v2 = self.vertices[cl[j]].cb
+                        f.write(f'{v1},{v2}\n')
+                        count += 1
+                # Class is identified by its number and first block, both in the order of write_classes
+                cf.write(f'{index}\t{self.vertices[cl[0]].cb}\t{len(cl)}\t{count}\n')
+                added.append(count)
+        return added
+
+def edge_key(v1: int, v2: int):
+    return min(v1, v2) << 32 | max(v1, v2)
 
 def parse_file(fn: str):
     with open(fn, "r") as f:
@@ -141,11 +169,11 @@ def lines_in_file(fn: str):
         num_lines = sum(1 for _ in f)
     return num_lines
 
-def merge(ifns: list[str], ofn: str):
+def merge(ifns: list[str], ofn: str, new_only: bool = False):
     total_lines = sum(lines_in_file(fn) for fn in ifns)
     current_line = 0
     progress = progressbar(total_lines, current_line)
-    g = clonegraph()
+    g = clonegraph(new_only)
     for fn in ifns:
         for x in parse_file(fn):
             current_line += 1
@@ -156,14 +184,23 @@ def merge(ifns: list[str], ofn: str):
     print(f'pairs, if make all components full:\t{sum([len(x) * (len(x) - 1) // 2 for x in g.classes.itersets()])}')
     print(f'original number of pairs:\t{g.total_edges}')
     print("Writing to file... ", end="")
-    g.full_to_file(ofn)
-    print("done.")
+    if new_only:
+        added = g.new_to_file(ofn)
+        print("done.")
+        print(f'distinct original pairs:\t{len(g.edges)}')
+        print(f'added pairs:\t{sum(added)}')
+        print(f'classes with added pairs:\t{sum(1 for x in added if x > 0)}')
+    else:
+        g.full_to_file(ofn)
+        print("done.")
     
 
 def main():
-    ifns = sys.argv[1:-1]
-    ofn = sys.argv[-1]
-    merge(ifns, ofn)
+    new_only = '--new-only' in sys.argv[1:]
+    fns = [fn for fn in sys.argv[1:] if fn != '--new-only']
+    ifns = fns[:-1]
+    ofn = fns[-1]
+    merge(ifns, ofn, new_only)
 
 if __name__ == "__main__":
     main()
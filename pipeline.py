@@ -0,0 +1,256 @@
+import os
+import time
+import heapq
+import tempfile
+import threading
+import queue
+import json
+
+'''
+Общие части конвейера shrink.py, subtract.py и setops.py: чтение файла
+в отдельном потоке, ограниченные очереди между потоками, оценка памяти
+для --max-memory, обработка слишком больших блоков на диске, разбор
+размеров и запись статистики.
+'''
+
+# Approximate memory of one clone pair in a block, with list and row overhead
+pair_size = 512
+
+# Approximate memory of one queued line, read or formatted for output
+line_size = 160
+
+# Defaults of the pipeline: chunks or batches in a queue, bytes read at once and output lines in a batch
+default_queue_size = 64
+default_chunk_size = 1 << 20
+default_batch_size = 10000
+
+def queue_memory(input_sizes: list[int], lines: int, queue_size: int, chunk_size: int, batch_size: int):
+    # Lines in full read queues and formatted lines in a full write queue, but not more than there are
+    read = sum(2 * min((queue_size + 1) * chunk_size, size) for size in input_sizes)
+    write = line_size * min((queue_size + 2) * batch_size, lines)
+    return read + write
+
+def split_memory(max_memory: int, inputs: int, queue_size: int, chunk_size: int, batch_size: int):
+    # Queued lines count against the budget too: a half of it goes to the block in processing,
+    # a quarter to the read queues and a quarter to the write queue
+    max_pairs = max(max_memory // 2 // pair_size, 1)
+    # Chunk of chunk_size bytes takes about twice as much, when it is split into lines
+    chunk_size = max(min(chunk_size, max_memory // 4 // (2 * inputs * (queue_size + 1))), 1 << 12)
+    batch_size = max(min(batch_size, max_memory // 4 // (line_size * (queue_size + 2))), 1)
+    return max_pairs, chunk_size, batch_size
+
+class stagequeue:
+    def __init__(self, maxsize: int):
+        self.queue = queue.Queue(maxsize)
+        self.maxsize = maxsize
+        self.samples = 0
+        self.occupied = 0
+        # Seconds, which put waited for a free slot and get waited for an item
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+        # Error of the stage on the other side of the queue
+        self.error = None
+    
+    def sample(self):
+        self.samples += 1
+        self.occupied += self.queue.qsize()
+    
+    def put(self, item):
+        self.sample()
+        start = None
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                start = start or time.time()
+        if start is not None:
+            self.put_wait += time.time() - start
+    
+    def get(self):
+        self.sample()
+        if self.error is None and not self.queue.empty():
+            return self.queue.get()
+        start = time.time()
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                item = self.queue.get(timeout=0.1)
+                self.get_wait += time.time() - start
+                return item
+            except queue.Empty:
+                pass
+    
+    def abort(self, error: BaseException):
+        self.error = error
+    
+    def close(self):
+        if self.error is None:
+            self.put(None)
+    
+    def occupancy(self):
+        if self.samples == 0:
+            return 0.0
+        return self.occupied / self.samples / self.maxsize
+
+class stage(threading.Thread):
+    def __init__(self, func, *args):
+        super().__init__(daemon=True)
+        self.func = func
+        self.args = args
+        self.error = None
+    
+    def run(self):
+        try:
+            self.func(*self.args)
+        except BaseException as e:
+            self.error = e
+            # Nobody should wait for this stage on its queues
+            for arg in self.args:
+                if isinstance(arg, stagequeue):
+                    arg.abort(e)
+    
+    def finish(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+def line_offset(fn: str, n: int):
+    # Byte offset of the n-th line
+    offset = 0
+    with open(fn, "rb") as f:
+        while n > 0:
+            chunk = f.read(1 << 24)
+            if not chunk:
+                break
+            count = chunk.count(b'\n')
+            if count < n:
+                n -= count
+                offset += len(chunk)
+                continue
+            pos = -1
+            for _ in range(n):
+                pos = chunk.index(b'\n', pos + 1)
+            return offset + pos + 1
+    return offset
+
+def read_lines(ifn: str, lines: stagequeue, skip: int, chunk_size: int):
+    # Only reading, parsing is done in the main thread: threads don't run Python code in parallel
+    try:
+        with open(ifn, "r") as f:
+            f.seek(line_offset(ifn, skip))
+            while True:
+                chunk = f.readlines(chunk_size)
+                if not chunk:
+                    break
+                lines.put(chunk)
+    finally:
+        lines.close()
+
+def queued_lines(lines: stagequeue):
+    while True:
+        chunk = lines.get()
+        if chunk is None:
+            return
+        yield from chunk
+
+def print_occupancy(read_queues: list[stagequeue], write_queue: stagequeue, elapsed: float):
+    read_occupancy = sum(q.occupancy() for q in read_queues) / len(read_queues)
+    write_occupancy = write_queue.occupancy()
+    # Time, which processing in the main thread spent waiting for the other stages
+    read_wait = sum(q.get_wait for q in read_queues)
+    write_wait = write_queue.put_wait
+    print(f'Read queue:\t{round(read_occupancy * 100, 1)}% full, waited {round(read_wait, 2)} s')
+    print(f'Write queue:\t{round(write_occupancy * 100, 1)}% full, waited {round(write_wait, 2)} s')
+    if write_wait > read_wait and write_wait > 0.1 * elapsed:
+        print('Bottleneck:\twriting (disk-bound)')
+    elif read_wait > 0.1 * elapsed:
+        print('Bottleneck:\treading (disk-bound)')
+    else:
+        print('Bottleneck:\tprocessing (CPU-bound)')
+
+class overlapstats:
+    # How many pairs of a block cover a line of a file on average, for the first and the second blocks of code
+    def __init__(self):
+        self.length = [0, 0]
+        self.lo = [None, None]
+        self.hi = [None, None]
+    
+    def add(self, cp):
+        for i, b in enumerate((cp.b1, cp.b2)):
+            self.length[i] += b.end - b.begin + 1
+            self.lo[i] = b.begin if self.lo[i] is None else min(self.lo[i], b.begin)
+            self.hi[i] = b.end if self.hi[i] is None else max(self.hi[i], b.end)
+    
+    def axis(self):
+        # The sweep goes along the blocks of code, which overlap less
+        depth = [self.length[i] / (self.hi[i] - self.lo[i] + 1) if self.length[i] else 0 for i in range(2)]
+        return 0 if depth[0] <= depth[1] else 1
+
+def axis_block(cp, axis: int):
+    return cp.b2 if axis else cp.b1
+
+def sort_spilled(fn: str, axis: int, max_memory: int):
+    # By the blocks of code on axis: begin ascending, end descending, so outer pairs come first
+    keys = '-k7,7n -k8,8nr -k3,3n -k4,4nr' if axis else '-k3,3n -k4,4nr -k7,7n -k8,8nr'
+    os.system(f'LC_ALL=C sort -t "," {keys} -S {max(max_memory // 1024, 1024)}K "{fn}" -o "{fn}"')
+
+def sweep_spilled(fn: str, parse, axis: int, max_pairs: int, reject, emit, progress=None):
+    '''
+    Shrinks a file sorted by sort_spilled: every pair is checked by reject(cp, window)
+    only against kept pairs, which intersect with it on axis. Kept pairs are given
+    to emit, when no next pair can intersect them. The window holds at most
+    max_pairs pairs, the rest goes to the next pass over the file. The file is removed.
+    '''
+    first = True
+    while True:
+        # Kept pairs in the order they were kept, and a heap of their ends to drop them
+        window = {}
+        ends = []
+        count = 0
+        overflow = None
+        # The farthest end of pairs left for the next pass: pairs before it must follow them
+        reach = None
+        with open(fn, "r") as f:
+            for line in f:
+                cp = parse(line)
+                b = axis_block(cp, axis)
+                if first and progress is not None:
+                    progress.increment()
+                expired = []
+                while ends and ends[0][0] < b.begin:
+                    expired.append(window.pop(heapq.heappop(ends)[1]))
+                if expired:
+                    emit(expired)
+                if reject(cp, window.values()):
+                    continue
+                if len(window) < max_pairs and (reach is None or b.begin > reach):
+                    window[count] = cp
+                    heapq.heappush(ends, (b.end, count))
+                    count += 1
+                    continue
+                if overflow is None:
+                    overflow = tempfile.NamedTemporaryFile(mode="w", delete=False, suffix='.spill')
+                overflow.write(line)
+                reach = b.end if reach is None else max(reach, b.end)
+        if window:
+            emit(list(window.values()))
+        os.remove(fn)
+        if overflow is None:
+            return
+        overflow.close()
+        fn = overflow.name
+        first = False
+
+def write_stats(fn: str, stats: dict):
+    with open(fn, "w") as f:
+        json.dump(stats, f, indent=4)
+
+def parse_size(size: str):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
@@ -0,0 +1,231 @@
+import sys
+import os
+import time
+import tempfile
+import tracemalloc
+import make_full
+import shrink
+import pipeline
+
+helpmsg = \
+'''
+Usage: python plan.py [-n top (default: 10)] <input1> ... <inputN>
+
+Оценивает заранее, сколько ресурсов потребуют make_full.py и shrink.py
+на файлах input1, ..., inputN, ничего не записывая на диск:
+- сколько пар клонов и байт будет в выводе make_full.py, всего, для
+  самых больших классов и для каждой директории;
+- сколько памяти понадобится make_full.py и shrink.py;
+- самые большие блоки с одинаковой парой файлов для shrink_block;
+- сколько времени займут make_full.py и shrink.py.
+
+Классы находятся так же, как в make_full.py, поэтому размер вывода
+make_full.py — это оценка. Время оценивается по небольшим замерам,
+которые делаются на этих же входных данных.
+'''
+
+calibration_pairs = 20000
+calibration_block = 1000
+
+def format_size(n: float):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if n < 1024 or unit == 'TB':
+            return f'{round(n, 1)} {unit}'
+        n /= 1024
+
+def format_time(t: float):
+    if t < 60:
+        return f'{round(t, 1)} s'
+    if t < 3600:
+        return f'{round(t / 60, 1)} min'
+    return f'{round(t / 3600, 1)} h'
+
+class classplan:
+    def __init__(self, blocks: list[make_full.codeblock]):
+        self.size = len(blocks)
+        self.pairs = self.size * (self.size - 1) // 2
+        # Every block appears in (size - 1) lines "b1,b2\n"
+        self.bytes = (self.size - 1) * sum(len(cb.__repr__()) for cb in blocks) + 2 * self.pairs
+        self.dirs = {}
+        for cb in blocks:
+            dir = cb.fn.split(',')[0]
+            self.dirs[dir] = self.dirs.get(dir, 0) + 1
+    
+    def line_length(self):
+        return self.bytes / self.pairs if self.pairs > 0 else 0
+    
+    def dir_pairs(self, dir: str):
+        # Pairs with at least one block in dir
+        c = self.dirs[dir]
+        return c * (self.size - c) + c * (c - 1) // 2
+
+class calibration:
+    def __init__(self, sample: list[tuple]):
+        self.graph_vertex_bytes, self.pair_bytes = self.measure_memory(sample)
+        self.write_time = self.measure_write(sample)
+        self.block_time = self.measure_block(sample[:calibration_block])
+        self.sort_time = self.measure_sort(sample)
+        self.line_time = self.measure_lines(sample)
+    
+    def measure_memory(self, sample: list[tuple]):
+        tracemalloc.start()
+        g = make_full.clonegraph()
+        for row in sample:
+            g.insert_edge(make_full.clonepair.from_row(*row))
+        graph_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        
+        tracemalloc.start()
+        pairs = [shrink.clonepair.from_row(*row) for row in sample]
+        pair_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del pairs
+        return graph_bytes / max(len(g.vertices), 1), pair_bytes / max(len(sample), 1)
+    
+    def measure_write(self, sample: list[tuple]):
+        blocks = [make_full.codeblock(*row[:3]) for row in sample]
+        start = time.time()
+        with open(os.devnull, "w") as f:
+            for i in range(1, len(blocks)):
+                f.write(f'{blocks[i]},{blocks[i - 1]}\n')
+        return (time.time() - start) / max(len(blocks) - 1, 1)
+    
+    def measure_block(self, sample: list[tuple]):
+        # Line ranges from the input, but all in one file pair, as in a big block
+        cps = [shrink.clonepair.from_row('a,a', r[1], r[2], 'b,b', r[4], r[5]) for r in sample]
+        progress = shrink.progressbar(sys.maxsize, 0)
+        start = time.time()
+        shrink.shrink_block(cps, 1.0, progress)
+        return (time.time() - start) / max(len(cps), 1) ** 2
+    
+    def measure_sort(self, sample: list[tuple]):
+        tf = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        tf.writelines(f'{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}\n' for r in sample)
+        tf.close()
+        start = time.time()
+        os.system(f'LC_ALL=C sort -t "," -k1,2 -k5,6 "{tf.name}" -o "{tf.name}"')
+        elapsed = time.time() - start
+        os.remove(tf.name)
+        return elapsed / max(len(sample), 1)
+    
+    def measure_lines(self, sample: list[tuple]):
+        # One pass of parsing, normalizing and writing, shrink.py does it three times
+        tf = tempfile.NamedTemporaryFile(mode="w", delete=False)
+        tf.writelines(f'{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}\n' for r in sample)
+        tf.close()
+        start = time.time()
+        with open(tf.name, "r") as f, open(os.devnull, "w") as of:
+            for line in f:
+                of.write(shrink.clonepair(line).__repr__() + '\n')
+        elapsed = time.time() - start
+        os.remove(tf.name)
+        return elapsed / max(len(sample), 1)
+
+def plan(ifns: list[str], top: int):
+    start = time.time()
+    
+    print("Counting lines... ", end="")
+    sys.stdout.flush()
+    total_lines = sum(shrink.lines_in_file(fn) for fn in ifns)
+    largest_file = max(shrink.lines_in_file(fn) for fn in ifns)
+    print("done.")
+    
+    print("Building classes... ")
+    sys.stdout.flush()
+    progress = make_full.progressbar(max(total_lines, 1), 0)
+    g = make_full.clonegraph()
+    blocks = {}
+    sample = []
+    current_line = 0
+    ingest_start = time.time()
+    for fn in ifns:
+        with open(fn, "r") as f:
+            for line in f:
+                current_line += 1
+                cp = make_full.clonepair(line.rstrip())
+                g.insert_edge(cp)
+                if len(sample) < calibration_pairs:
+                    sample.append((cp.b1.fn, cp.b1.begin, cp.b1.end, cp.b2.fn, cp.b2.begin, cp.b2.end))
+                # Same order of file names as in shrink.py
+                key = (cp.b1.fn, cp.b2.fn) if cp.b1.fn >= cp.b2.fn else (cp.b2.fn, cp.b1.fn)
+                blocks[key] = blocks.get(key, 0) + 1
+                progress.update(current_line)
+    ingest_time = time.time() - ingest_start
+    progress.end()
+    
+    classes = [classplan([g.vertices[v].cb for v in c]) for c in g.classes.itersets()]
+    classes.sort(key=lambda c: c.pairs, reverse=True)
+    total_pairs = sum(c.pairs for c in classes)
+    total_bytes = sum(c.bytes for c in classes)
+    
+    dirs = {}
+    for c in classes:
+        for dir in c.dirs:
+            pairs, size = dirs.get(dir, (0, 0))
+            dir_pairs = c.dir_pairs(dir)
+            dirs[dir] = (pairs + dir_pairs, size + dir_pairs * c.line_length())
+    
+    block_sizes = sorted(((n, fn1, fn2) for (fn1, fn2), n in blocks.items()), reverse=True)
+    
+    print("Calibrating... ", end="")
+    sys.stdout.flush()
+    calib = calibration(sample)
+    print("done.")
+    
+    print(f'\n-- make_full.py --')
+    print(f'total classes:\t{len(classes)}')
+    print(f'original number of pairs:\t{g.total_edges}')
+    print(f'pairs, if make all components full:\t{total_pairs}')
+    print(f'output size:\t{format_size(total_bytes)}')
+    print(f'peak memory:\t{format_size(len(g.vertices) * calib.graph_vertex_bytes + largest_file * calib.pair_bytes)}')
+    print(f'time:\t\t{format_time(ingest_time + total_pairs * calib.write_time)}')
+    
+    print(f'\nLargest classes:')
+    print(f'blocks\tpairs\t\tsize')
+    for c in classes[:top]:
+        print(f'{c.size}\t{c.pairs}\t\t{format_size(c.bytes)}')
+    
+    print(f'\nDirectories (pairs with at least one block in directory):')
+    print(f'pairs\t\tsize\t\tdirectory')
+    for dir, (pairs, size) in sorted(dirs.items(), key=lambda x: x[1][0], reverse=True)[:top]:
+        print(f'{pairs}\t\t{format_size(size)}\t\t{dir}')
+    
+    block_work = sum(n * n for n, _, _ in block_sizes)
+    # The largest block is held whole, with chunks of every input and output batches in full queues
+    largest_block = block_sizes[0][0] if block_sizes else 0
+    queued = pipeline.queue_memory([os.path.getsize(fn) for fn in ifns], total_lines, pipeline.default_queue_size,
+                                   pipeline.default_chunk_size, pipeline.default_batch_size)
+    print(f'\n-- shrink.py --')
+    print(f'file pairs:\t{len(block_sizes)}')
+    print(f'peak memory:\t{format_size(largest_block * calib.pair_bytes + queued)}')
+    print(f'time:\t\t{format_time(total_lines * (3 * calib.line_time + calib.sort_time) + block_work * calib.block_time)}')
+    
+    print(f'\nLargest file-pair blocks:')
+    print(f'pairs\ttime\t\tfile pair')
+    for n, fn1, fn2 in block_sizes[:top]:
+        print(f'{n}\t{format_time(n * n * calib.block_time)}\t\t{fn1};{fn2}')
+    
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+
+def help():
+    print(helpmsg)
+    exit(0)
+
+def main():
+    top = 10
+    ifns = []
+    i = 1
+    while (i < len(sys.argv)):
+        if sys.argv[i] == '-n':
+            i += 1
+            top = int(sys.argv[i])
+        else:
+            ifns.append(sys.argv[i])
+        i += 1
+    if not ifns:
+        help()
+    
+    plan(ifns, top)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import sys
+import time
+import zlib
+import shrink
+import make_full
+
+helpmsg = \
+'''
+Usage: python sample.py [-r rate (default: 0.01)] [-t threshold (default: 1.0)]
+                        [-g groups (default: 10)] [-s seed (default: 0)] <input1> ... <inputN>
+
+Быстро оценивает по случайной выборке, что получится после shrink.py и
+make_full.py на объединении файлов input1, ..., inputN.
+
+В выборку попадают пары файлов (как в clonepair.get_filepair), хеш
+которых меньше rate, поэтому блоки с одинаковой парой файлов попадают в
+выборку целиком. На выборке запускаются настоящие shrink_block (при
+threshold = 1.0, как и в shrink.py, после удаления точных копий) и поиск
+классов из make_full.py, а результат пересчитывается на весь набор:
+- доля дубликатов и вложенных пар клонов, и размер вывода shrink.py;
+- число классов и распределение их размеров;
+- сколько пар клонов получится после make_full.py.
+
+Доверительные интервалы (95%) считаются методом случайных групп:
+выборка делится на groups частей по тому же хешу, и оценки по частям
+сравниваются между собой. Размеры классов в выборке меньше настоящих,
+так как в выборку попадает только часть рёбер графа, поэтому оценка
+для make_full.py занижена на сильно связных данных.
+'''
+
+# 97.5% quantiles of Student's t distribution by degrees of freedom
+t_quantiles = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36, 8: 2.31, 9: 2.26,
+               10: 2.23, 15: 2.13, 20: 2.09, 30: 2.04, 60: 2.00, 120: 1.98}
+
+def t_quantile(df: int):
+    return t_quantiles[max(k for k in t_quantiles if k <= max(df, 1))]
+
+class estimate:
+    def __init__(self, value: float, groups: list[float]):
+        self.value = value
+        n = len(groups)
+        mean = sum(groups) / n
+        se = (sum((g - mean) ** 2 for g in groups) / (n * (n - 1))) ** 0.5 if n > 1 else 0
+        self.error = t_quantile(n - 1) * se
+    
+    def format(self, scale: float = 1, digits: int = 0, suffix: str = ''):
+        value = round(self.value * scale, digits)
+        error = round(self.error * scale, digits)
+        if digits == 0:
+            value, error = int(value), int(error)
+        return f'{value}{suffix} ± {error}{suffix}'
+
+class samplestats:
+    def __init__(self):
+        self.total = 0
+        self.duplicates = 0
+        self.nested = 0
+        self.graph = make_full.clonegraph()
+    
+    def add_block(self, rows: list[tuple], threshold: float):
+        exact = threshold == 1.0
+        dropped = 0
+        if exact:
+            # Exact copies are dropped first and counted as duplicates, as in shrink.read_blocks
+            unique = list(dict.fromkeys(rows))
+            dropped = len(rows) - len(unique)
+            rows = unique
+        block = [shrink.clonepair.from_row(*row) for row in rows]
+        _, duplicates, nested, total = shrink.shrink_block(block, threshold, shrink.progressbar(sys.maxsize, 0), exact)
+        self.total += total + dropped
+        self.duplicates += duplicates + dropped
+        self.nested += nested
+        for row in rows:
+            self.graph.insert_edge(make_full.clonepair.from_row(*row))
+    
+    def class_sizes(self):
+        return sorted(len(c) for c in self.graph.classes.itersets())
+    
+    def full_pairs(self):
+        return sum(n * (n - 1) // 2 for n in self.class_sizes())
+
+def filepair_group(name1: str, name2: str, rate: float, groups: int, seed: int):
+    # Stable hash in [0, 1): the same file pair is picked in every run and every input
+    h = zlib.crc32(f'{seed};{name1};{name2}'.encode()) / 2 ** 32
+    if h >= rate:
+        return -1
+    return int(h / rate * groups)
+
+def collect(ifns: list[str], rate: float, groups: int, seed: int):
+    # Only name fields are looked at in every line, rows are built for picked file pairs only
+    picked = {}
+    blocks = {}
+    total_lines = 0
+    for fn in ifns:
+        with open(fn, "r") as f:
+            prev_names = None
+            group = -1
+            for line in f:
+                if not line.strip():
+                    continue
+                fields = line.split(',', 7)
+                if len(fields) < 8:
+                    raise ValueError(f'Expected 8 fields, got {len(fields)}: "{line.rstrip()}"')
+                total_lines += 1
+                names = (fields[0], fields[1], fields[4], fields[5])
+                if names != prev_names:
+                    # Lines of one file pair usually go together, so the hash is rarely recomputed
+                    prev_names = names
+                    name1, name2 = f'{fields[0]},{fields[1]}', f'{fields[4]},{fields[5]}'
+                    key = (name1, name2) if name1 >= name2 else (name2, name1)
+                    group = filepair_group(key[0], key[1], rate, groups, seed)
+                if group < 0:
+                    continue
+                picked[key] = group
+                # Same order of blocks as in clonepair: b1.fn >= b2.fn
+                if name1 >= name2:
+                    row = (name1, int(fields[2]), int(fields[3]), name2, int(fields[6]), int(fields[7]))
+                else:
+                    row = (name2, int(fields[6]), int(fields[7]), name1, int(fields[2]), int(fields[3]))
+                blocks.setdefault(key, []).append(row)
+    return blocks, picked, total_lines
+
+def percentile(values: list[int], p: float):
+    return values[min(int(p * len(values)), len(values) - 1)]
+
+def sample(ifns: list[str], rate: float, threshold: float, groups: int, seed: int):
+    start = time.time()
+    
+    print("Sampling file pairs... ", end="")
+    sys.stdout.flush()
+    blocks, picked, total_lines = collect(ifns, rate, groups, seed)
+    print("done.")
+    sys.stdout.flush()
+    
+    print("Processing sample... ", end="")
+    sys.stdout.flush()
+    whole = samplestats()
+    parts = [samplestats() for _ in range(groups)]
+    for key, rows in blocks.items():
+        # Same order inside a block, as after sorting in shrink.py
+        rows.sort(key=lambda r: f'{r[0]},{r[1]},{r[2]},{r[3]},{r[4]},{r[5]}')
+        whole.add_block(rows, threshold)
+        parts[picked[key]].add_block(rows, threshold)
+    print("done.\n")
+    
+    if whole.total == 0:
+        print(f'Sample is empty, try a larger rate.')
+        return
+    parts = [p for p in parts if p.total > 0]
+    
+    sizes = whole.class_sizes()
+    group_rate = rate / groups
+    duplicates = estimate(whole.duplicates / whole.total, [p.duplicates / p.total for p in parts])
+    nested = estimate(whole.nested / whole.total, [p.nested / p.total for p in parts])
+    approved = estimate(1 - (whole.duplicates + whole.nested) / whole.total,
+                        [1 - (p.duplicates + p.nested) / p.total for p in parts])
+    classes = estimate(len(sizes) / rate, [len(p.class_sizes()) / group_rate for p in parts])
+    full_pairs = estimate(whole.full_pairs() / rate, [p.full_pairs() / group_rate for p in parts])
+    
+    print(f'Total input:\t{total_lines} pairs')
+    print(f'Sample:\t\t{whole.total} pairs in {len(blocks)} file pairs\n')
+    
+    print(f'-- shrink.py (threshold {threshold}) --')
+    print(f'Approved:\t{approved.format(100, 3, "%")}\t(~{approved.format(total_lines)} pairs)')
+    print(f'Duplicates:\t{duplicates.format(100, 3, "%")}\t(~{duplicates.format(total_lines)} pairs)')
+    print(f'Nested:\t\t{nested.format(100, 3, "%")}\t(~{nested.format(total_lines)} pairs)\n')
+    
+    print(f'-- make_full.py --')
+    print(f'total classes:\t{classes.format()}')
+    print(f'pairs, if make all components full:\t{full_pairs.format()}')
+    print(f'class sizes in sample:\tmedian {percentile(sizes, 0.5)}, 90% {percentile(sizes, 0.9)}, '
+          f'99% {percentile(sizes, 0.99)}, max {sizes[-1]}')
+    print(f'(classes are built from sampled pairs only and are smaller than real ones, plan.py counts them exactly)')
+    
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+
+def help():
+    print(helpmsg)
+    exit(0)
+
+def main():
+    rate = 0.01
+    threshold = 1.0
+    groups = 10
+    seed = 0
+    ifns = []
+    i = 1
+    while (i < len(sys.argv)):
+        if sys.argv[i] == '-r':
+            i += 1
+            rate = float(sys.argv[i])
+        elif sys.argv[i] == '-t':
+            i += 1
+            threshold = float(sys.argv[i])
+        elif sys.argv[i] == '-g':
+            i += 1
+            groups = int(sys.argv[i])
+        elif sys.argv[i] == '-s':
+            i += 1
+            seed = int(sys.argv[i])
+        else:
+            ifns.append(sys.argv[i])
+        i += 1
+    if threshold <= 0 or threshold > 1:
+        print("Threshold must be in [0.0, 1.0] range.")
+        exit(0)
+    if rate <= 0 or rate > 1:
+        print("Rate must be in (0.0, 1.0] range.")
+        exit(0)
+    if not ifns:
+        help()
+    
+    sample(ifns, rate, threshold, groups, seed)
+
+if __name__ == "__main__":
+    main()
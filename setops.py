@@ -0,0 +1,187 @@
+import sys
+import os
+import time
+from subtract import clonepair, progressbar, concat_files, sort_lines, read_blocks, shrink_block, block_lines, lines_in_file
+from pipeline import stagequeue, stage, read_lines, queued_lines, print_occupancy, default_queue_size, \
+    default_batch_size, default_chunk_size
+
+helpmsg = \
+'''
+Usage: python setops.py [-t threshold (default: 1.0)] [-i intersection] [-u union]
+                        [-d difference] [-D reverse_difference] [-x symmetric_difference]
+                        <input1> <input2>
+
+Операции над двумя наборами пар клонов за одну сортировку и один проход:
+- intersection: пары из input1, у которых есть дубликат в input2;
+- union: пары из input1 и reverse_difference;
+- difference: пары из input1, у которых нет дубликата в input2, то же,
+  что выводит subtract.py;
+- reverse_difference: пары из input2, у которых нет дубликата в input1
+  (subtract.py input2 input1);
+- symmetric_difference: difference и reverse_difference вместе.
+
+Каждая операция записывается в свой файл, если он указан. Дубликаты
+внутри одного входного файла удаляются. Как и в subtract.py, в
+difference и reverse_difference пары сравниваются с другим входным
+файлом без его дубликатов, а дубликаты удаляются только среди
+оставшихся пар, поэтому при threshold < 1.0 сумма областей может не
+совпадать с числом пар входного файла без дубликатов. Всегда выводится,
+сколько пар попало в каждую область диаграммы Венна.
+
+Дубликаты определяются с точностью до threshold, так же как и в
+BigCloneEval (см. subtract.py).
+'''
+
+operations = {
+    '-i': 'intersection',
+    '-u': 'union',
+    '-d': 'difference',
+    '-D': 'reverse_difference',
+    '-x': 'symmetric_difference',
+}
+
+def venn_blocks(block1: list[clonepair], block2: list[clonepair], threshold: float):
+    # Differences are found as in subtract_blocks: pairs are checked against the other input shrunk,
+    # and only pairs without a duplicate there are shrunk among themselves
+    shrunk1 = shrink_block(block1, threshold)
+    shrunk2 = shrink_block(block2, threshold)
+    matched1 = {id(cp) for cp in block1 if any(clonepair.duplicate(cp, xcp, threshold) for xcp in shrunk2)}
+    matched2 = {id(cp) for cp in block2 if any(clonepair.duplicate(cp, xcp, threshold) for xcp in shrunk1)}
+    only1 = shrink_block([cp for cp in block1 if id(cp) not in matched1], threshold)
+    both1 = [cp for cp in shrunk1 if id(cp) in matched1]
+    both2 = [cp for cp in shrunk2 if id(cp) in matched2]
+    only2 = shrink_block([cp for cp in block2 if id(cp) not in matched2], threshold)
+    return shrunk1, only1, both1, both2, only2
+
+def region_blocks(shrunk1: list[clonepair], only1: list[clonepair], both1: list[clonepair], only2: list[clonepair]):
+    return {
+        'intersection': both1,
+        'union': shrunk1 + only2,
+        'difference': only1,
+        'reverse_difference': only2,
+        'symmetric_difference': only1 + only2,
+    }
+
+def write_regions(ofns: dict, blocks: stagequeue):
+    files = {op: open(ofn, "w") for op, ofn in ofns.items()}
+    try:
+        while True:
+            regions = blocks.get()
+            if regions is None:
+                break
+            for op, f in files.items():
+                f.writelines(regions[op])
+    finally:
+        for f in files.values():
+            f.close()
+
+def setops(ifn1: str, ifn2: str, ofns: dict, threshold: float, queue_size: int = default_queue_size,
+           batch_size: int = default_batch_size, chunk_size: int = default_chunk_size):
+    start = time.time()
+    
+    print("Counting lines... ", end="")
+    sys.stdout.flush()
+    total_lines = lines_in_file(ifn1) + lines_in_file(ifn2)
+    print("done.")
+    sys.stdout.flush()
+    
+    print("Concatenating files... ")
+    sys.stdout.flush()
+    tfn = concat_files(ifn1, ifn2, total_lines)
+    print("done.")
+    sys.stdout.flush()
+    
+    print(f'Temporary file: "{tfn}"')
+    
+    print("Sorting all lines... ")
+    sys.stdout.flush()
+    sort_lines(tfn, total_lines)
+    print("\ndone.")
+    sys.stdout.flush()
+    
+    progress = progressbar(total_lines, 0, 4)
+    
+    processing_start = time.time()
+    read_queue = stagequeue(queue_size)
+    write_queue = stagequeue(queue_size)
+    reader = stage(read_lines, tfn, read_queue, 0, chunk_size)
+    writer = stage(write_regions, ofns, write_queue)
+    reader.start()
+    writer.start()
+    
+    only1 = 0
+    both1 = 0
+    both2 = 0
+    only2 = 0
+    regions = {op: [] for op in ofns}
+    pending = 0
+    try:
+        for _, (block1, block2) in read_blocks(queued_lines(read_queue)):
+            bshrunk1, bonly1, bboth1, bboth2, bonly2 = venn_blocks(block1, block2, threshold)
+            bregions = region_blocks(bshrunk1, bonly1, bboth1, bonly2)
+            for op in ofns:
+                regions[op].extend(block_lines(bregions[op]))
+                pending += len(bregions[op])
+            if pending >= batch_size:
+                write_queue.put(regions)
+                regions = {op: [] for op in ofns}
+                pending = 0
+            progress.add(len(block1) + len(block2))
+            
+            only1 += len(bonly1)
+            both1 += len(bboth1)
+            both2 += len(bboth2)
+            only2 += len(bonly2)
+        write_queue.put(regions)
+    finally:
+        write_queue.close()
+    reader.finish()
+    writer.finish()
+    progress.end()
+    print(f'Only in input1:\t{only1} pairs')
+    print(f'In both:\t{both1} pairs of input1, {both2} pairs of input2')
+    print(f'Only in input2:\t{only2} pairs\n')
+    print(f'Intersection:\t\t{both1} pairs')
+    print(f'Union:\t\t\t{only1 + both1 + only2} pairs')
+    print(f'Difference:\t\t{only1} pairs')
+    print(f'Reverse difference:\t{only2} pairs')
+    print(f'Symmetric difference:\t{only1 + only2} pairs')
+    print()
+    print_occupancy([read_queue], write_queue, time.time() - processing_start)
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+    os.remove(tfn)
+
+def help():
+    print(helpmsg)
+    exit(0)
+
+def main():
+    threshold = 1.0
+    ifn1 = None
+    ifn2 = None
+    ofns = {}
+    i = 1
+    while (i < len(sys.argv)):
+        if sys.argv[i] == '-t':
+            i += 1
+            threshold = float(sys.argv[i])
+        elif sys.argv[i] in operations:
+            i += 1
+            ofns[operations[sys.argv[i - 1]]] = sys.argv[i]
+        elif ifn1 is None:
+            ifn1 = sys.argv[i]
+        elif ifn2 is None:
+            ifn2 = sys.argv[i]
+        else:
+            help()
+        i += 1
+    if threshold <= 0 or threshold > 1:
+        print("Threshold must be in [0.0, 1.0] range.")
+        exit(0)
+    if ifn1 is None or ifn2 is None:
+        help()
+    
+    setops(ifn1, ifn2, ofns, threshold)
+
+if __name__ == "__main__":
+    main()
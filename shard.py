@@ -0,0 +1,153 @@
+import sys
+import os
+import time
+import json
+import zlib
+import shutil
+from shrink import progressbar, clonepair, lines_in_file
+
+helpmsg = \
+'''
+Usage: python shard.py partition -n shards <input1> ... <inputN> <outdir>
+       python shard.py combine <output> <output1> ... <outputN>
+
+Разбиение запусков shrink.py и subtract.py на независимые части, которые
+можно обрабатывать на разных машинах или в разных процессах.
+
+partition: раскладывает пары клонов из input1, ..., inputN по shards
+частям по хешу пары файлов (как в clonepair.get_filepair), и записывает
+часть k каждого входного файла в outdir/k/<имя входного файла>, поэтому
+имена входных файлов должны различаться. Все пары клонов с одинаковой
+парой файлов попадают в одну часть, поэтому shrink.py и subtract.py на
+каждой части дают ровно ту часть общего результата, которая к ней
+относится. Блоки кода в парах записываются в нормализованном порядке.
+
+combine: склеивает выводы output1, ..., outputN в output. Если рядом с
+выводами есть файлы статистики (флаг --stats у shrink.py и
+subtract.py), то они складываются в output.stats и выводятся.
+'''
+
+def shard_of(name1: str, name2: str, shards: int):
+    # Stable hash, the same in every run and on every node
+    return zlib.crc32(f'{name1};{name2}'.encode()) % shards
+
+def partition(ifns: list[str], outdir: str, shards: int):
+    start = time.time()
+    
+    basenames = [os.path.basename(fn) for fn in ifns]
+    for i, name in enumerate(basenames):
+        if name in basenames[:i]:
+            # Parts of both files would go to the same outdir/k/<name>
+            print(f'Input files "{ifns[basenames.index(name)]}" and "{ifns[i]}" have the same name.')
+            exit(0)
+    
+    print("Counting lines... ", end="")
+    sys.stdout.flush()
+    total_lines = sum(lines_in_file(fn) for fn in ifns)
+    print("done.")
+    
+    for k in range(shards):
+        os.makedirs(os.path.join(outdir, str(k)), exist_ok=True)
+    
+    print("Partitioning... ")
+    sys.stdout.flush()
+    progress = progressbar(max(total_lines, 1), 0)
+    shard_ids = {}
+    sizes = [0] * shards
+    for fn in ifns:
+        files = [open(os.path.join(outdir, str(k), os.path.basename(fn)), "w") for k in range(shards)]
+        try:
+            with open(fn, "r") as f:
+                for line in f:
+                    cp = clonepair(line)
+                    key = (cp.b1.fn, cp.b2.fn)
+                    k = shard_ids.get(key)
+                    if k is None:
+                        k = shard_ids[key] = shard_of(cp.b1.fn, cp.b2.fn, shards)
+                    files[k].write(cp.__repr__() + '\n')
+                    sizes[k] += 1
+                    progress.increment()
+        finally:
+            for f in files:
+                f.close()
+    progress.end()
+    
+    print(f'file pairs:\t{len(shard_ids)}')
+    print(f'pairs in shards:\tmin {min(sizes)}, max {max(sizes)}')
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+
+def add_stats(total: dict, stats: dict):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            add_stats(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+
+def print_stats(stats: dict, indent: str = ''):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            if value:
+                print(f'{indent}{key}:')
+                print_stats(value, indent + '    ')
+        else:
+            print(f'{indent}{key}:\t{value}')
+
+def combine(ofn: str, ifns: list[str]):
+    start = time.time()
+    
+    print("Concatenating outputs... ", end="")
+    sys.stdout.flush()
+    with open(ofn, "wb") as of:
+        for fn in ifns:
+            with open(fn, "rb") as f:
+                shutil.copyfileobj(f, of, 1 << 24)
+    print("done.")
+    
+    sfns = [fn + '.stats' for fn in ifns]
+    missing = [sfn for sfn in sfns if not os.path.exists(sfn)]
+    if len(missing) == len(sfns):
+        print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+        return
+    if missing:
+        print(f'Stats file "{missing[0]}" is missing, stats are not combined.')
+        exit(0)
+    stats = {}
+    for sfn in sfns:
+        with open(sfn, "r") as f:
+            add_stats(stats, json.load(f))
+    with open(ofn + '.stats', "w") as f:
+        json.dump(stats, f, indent=4)
+    print()
+    print_stats(stats)
+    print(f'\nElapsed time: {round(time.time() - start, 2)} s')
+
+def help():
+    print(helpmsg)
+    exit(0)
+
+def main():
+    if len(sys.argv) < 2:
+        help()
+    command = sys.argv[1]
+    shards = None
+    args = []
+    i = 2
+    while (i < len(sys.argv)):
+        if sys.argv[i] == '-n':
+            i += 1
+            shards = int(sys.argv[i])
+        else:
+            args.append(sys.argv[i])
+        i += 1
+    if command == 'partition' and len(args) >= 2:
+        if shards is None or shards < 1:
+            print("Number of shards must be at least 1.")
+            exit(0)
+        partition(args[:-1], args[-1], shards)
+    elif command == 'combine' and len(args) >= 2:
+        combine(args[0], args[1:])
+    else:
+        help()
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,41 @@ import sys
 import os
 import time
 import tempfile
+import heapq
+import json
+from pipeline import pair_size, split_memory, stagequeue, stage, read_lines, queued_lines, print_occupancy, \
+    write_stats, parse_size, overlapstats, sort_spilled, sweep_spilled, default_queue_size, default_batch_size, \
+    default_chunk_size
 
 helpmsg = \
 '''
-Usage: python shrink.py [-t threshold (default: 1.0)] <input> <output>
+Usage: python shrink.py [-t threshold (default: 1.0)] [-p | -P sidecar]
+                        [-c interval (default: 60)] [--resume] [--max-memory size] [--stats]
+                        [-s] <input1> [... [-s] <inputN>] <output>
 
-Удаляет дубликаты и вложенные пары клонов из файла input, 
-и выводит результат в output.
+Удаляет дубликаты и вложенные пары клонов из объединения файлов
+input1, ..., inputN, и выводит результат в output.
+
+Каждый входной файл сортируется отдельно, после чего файлы сливаются
+по парам файлов за один проход. Входной файл, перед которым стоит флаг
+-s, считается уже отсортированным (например, это вывод shrink.py), и его
+сортировка пропускается. Пары клонов внутри блока с одинаковой парой
+файлов упорядочиваются по тексту строки, как при сортировке одного
+файла, поэтому результат не зависит от порядка входных файлов и
+совпадает с shrink.py на их объединении.
+
+С флагом -p в output добавляется девятая колонка с именами входных
+файлов (через "+"), в которых встретилась пара клонов или её дубликат.
+С флагом -P эти же имена записываются построчно в отдельный файл
+sidecar, а output остаётся в формате BigCloneEval.
+
+Каждые interval секунд состояние обработки сохраняется в файл
+output.checkpoint: отсортированные временные файлы, сколько строк из
+них уже обработано и сколько байт записано в output. С флагом --resume
+прерванный запуск с теми же аргументами (пути файлов сравниваются как
+абсолютные, --max-memory тоже должен совпадать) продолжается с последней
+сохранённой точки, без повторной сортировки. Временные файлы создаются
+в TMPDIR и удаляются только после успешного завершения.
 
 Дубликаты определяются с точностью до threshold, так же как и в
 BigCloneEval: 
@@ -18,6 +46,25 @@ BigCloneEval:
 - если у двух пар клонов оба соответствующих блока совпадают по
   определению выше, то эти пары клонов считают дубликатами, и одна
   из них удаляется.
+
+При threshold = 1.0 (по умолчанию) точные копии пар клонов удаляются
+сразу при чтении, по хешу, а для оставшихся проверяется только
+вложенность. Вывод от этого не меняется, но точные копии вложенных пар
+считаются дубликатами, а не вложенными.
+
+С флагом --max-memory (например, 2G) память на обработку ограничена
+size байтами: половина отводится на блок с одинаковой парой файлов,
+остальное на очереди чтения и записи. Блоки, которые не помещаются в
+свою половину, обрабатываются на диске:
+блок сортируется с помощью sort по началу первых или вторых блоков кода
+(тех, что меньше перекрываются), и пары клонов сравниваются только с
+теми оставленными парами, с которыми они пересекаются. Если таких пар
+больше, чем помещается в память, остальные обрабатываются следующими
+проходами по файлу. В таких блоках из вложенных пар остаётся внешняя, а
+не первая по порядку. Список таких блоков выводится в конце.
+
+С флагом --stats итоговая статистика также записывается в формате JSON
+в файл output.stats (её складывает shard.py combine).
 '''
 
 class progressbar:
@@ -36,12 +83,15 @@ class progressbar:
     def perc(self, val=None):
         if val is None:
             val = self.val
-        return val / self.maxval
+        # Empty inputs, e.g. an empty shard, are done from the start
+        return val / self.maxval if self.maxval > 0 else 1.0
     
     def perc_number(self, val=None):
         return round(self.perc(val) * 100, self.precision)
     
     def eta(self):
+        if self.realval == self.startval:
+            return 0.0
         return round((time.time() - self.starttime) * (self.maxval - self.realval) / (self.realval - self.startval), 2)
     
     def elapsed(self):
@@ -57,9 +107,10 @@ class progressbar:
         sys.stdout.flush()
     
     def update(self, val):
-        if round(self.perc_number(val), self.precision) > round(self.perc_number(), self.precision):
-            curr_time = time.time()
-            if time.time() - self.prevtime > 0.5:
+        # Time is checked first, it is much cheaper than the percents
+        curr_time = time.time()
+        if curr_time - self.prevtime > 0.5:
+            if round(self.perc_number(val), self.precision) > round(self.perc_number(), self.precision):
                 self.val = val
                 self.prevtime = curr_time
                 self.show()
@@ -68,6 +119,10 @@ class progressbar:
         self.realval += 1
         self.update(self.realval)
     
+    def add(self, n: int):
+        self.realval += n
+        self.update(self.realval)
+    
     def end(self):
         self.val = self.maxval
         self.prevtime = time.time()
@@ -99,12 +154,24 @@ class codeblock:
 
 class clonepair:
     def __init__(self, s: str):
+        self.sources = 1
         dir1, fn1, begin1, end1, dir2, fn2, begin2, end2 = s.split(',')
         self.b1 = codeblock(f'{dir1},{fn1}', int(begin1), int(end1))
         self.b2 = codeblock(f'{dir2},{fn2}', int(begin2), int(end2))
         if self.b1.fn < self.b2.fn:
             self.b1, self.b2 = self.b2, self.b1
     
+    @classmethod
+    def from_row(cls, fn1: str, begin1: int, end1: int, fn2: str, begin2: int, end2: int, source: int = 0):
+        cp = cls.__new__(cls)
+        # Bit mask of input files, where this pair or its duplicate was found
+        cp.sources = 1 << source
+        cp.b1 = codeblock(fn1, begin1, end1)
+        cp.b2 = codeblock(fn2, begin2, end2)
+        if cp.b1.fn < cp.b2.fn:
+            cp.b1, cp.b2 = cp.b2, cp.b1
+        return cp
+    
     def __repr__(self):
         return f'{self.b1.__repr__()},{self.b2.__repr__()}'
     
@@ -139,9 +206,10 @@ def sort_file_order(ifn: str, total_lines: int):
 def sort_lines(ifn: str, total_lines: int):
     td = tempfile.mkdtemp()
     batch_size = 500000
-    total_files = (total_lines + batch_size - 1) // batch_size
+    total_files = max((total_lines + batch_size - 1) // batch_size, 1)
     
     cmd = f'''
+export LC_ALL=C
 split -l {batch_size} "{ifn}" {td}/
 i=0
 for f in {td}/*
@@ -156,7 +224,10 @@ rm -rf {td}/
     '''
     os.system(cmd)
 
-def shrink_block(block: list[clonepair], threshold: float, progress: progressbar):
+def shrink_block(block: list[clonepair], threshold: float, progress: progressbar, exact_removed: bool = False):
+    # With threshold 1.0 only exact copies are duplicates, so if they are
+    # already removed, only nested pairs are left to check
+    check_duplicates = threshold < 1.0 or not exact_removed
     result = []
     duplicates = 0
     nested = 0
@@ -166,7 +237,8 @@ def shrink_block(block: list[clonepair], threshold: float, progress: progressbar
         approved = True
         total += 1
         for cp2 in result:
-            if clonepair.duplicate(cp1, cp2, threshold=threshold):
+            if check_duplicates and clonepair.duplicate(cp1, cp2, threshold=threshold):
+                cp2.sources |= cp1.sources
                 duplicates += 1
                 approved = False
                 break
@@ -178,104 +250,394 @@ def shrink_block(block: list[clonepair], threshold: float, progress: progressbar
             result.append(cp1)
     return (result, duplicates, nested, total)
 
-def write_block(block: list[clonepair], of):
-    of.writelines([cp.__repr__() + "\n" for cp in block])
+def source_labels(sources: int, labels: list[str]):
+    return '+'.join(label for i, label in enumerate(labels) if sources >> i & 1)
+
+class writebatch:
+    # Output lines, formatted in the main thread, so the writer only writes them
+    def __init__(self, labels: list[str], column: bool, sidecar: bool, sources: dict):
+        self.labels = labels
+        self.column = column
+        self.sidecar = sidecar
+        self.sources = dict(sources)
+        self.lines = []
+        self.sidecar_lines = []
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    def extend(self, block: list[clonepair]):
+        if self.column:
+            self.lines.extend([f'{cp.__repr__()},{source_labels(cp.sources, self.labels)}\n' for cp in block])
+        else:
+            self.lines.extend([cp.__repr__() + '\n' for cp in block])
+        if self.sidecar:
+            self.sidecar_lines.extend([source_labels(cp.sources, self.labels) + '\n' for cp in block])
+        if len(self.labels) == 1:
+            self.sources[1] = self.sources.get(1, 0) + len(block)
+            return
+        for cp in block:
+            self.sources[cp.sources] = self.sources.get(cp.sources, 0) + 1
+    
+    def take(self, progress: dict = None):
+        if progress is not None:
+            progress['sources'] = dict(self.sources)
+        item = (self.lines, self.sidecar_lines, progress)
+        self.lines = []
+        self.sidecar_lines = []
+        return item
+
+def read_sorted(ifn: str, lines, source: int):
+    prev_filepair = None
+    for line in lines:
+        cp = clonepair(line)
+        cp.sources = 1 << source
+        curr_filepair = (cp.b1.fn, cp.b2.fn)
+        if prev_filepair is not None and curr_filepair < prev_filepair:
+            raise ValueError(f'"{ifn}" is not sorted by file pairs')
+        prev_filepair = curr_filepair
+        yield (curr_filepair, source, cp)
+
+def filepair_key(item: tuple):
+    return item[0]
+
+class spilledblock:
+    def __init__(self, block: list[clonepair]):
+        self.file = tempfile.NamedTemporaryFile(mode="w", delete=False, suffix='.spill')
+        self.fn = self.file.name
+        self.filepair = block[0].get_filepair()
+        self.size = 0
+        self.stats = overlapstats()
+        for cp in block:
+            self.append(cp)
+    
+    def append(self, cp: clonepair):
+        # The last column is the bit mask of sources
+        self.file.write(f'{cp.__repr__()},{cp.sources}\n')
+        self.stats.add(cp)
+        self.size += 1
+    
+    def close(self):
+        self.file.close()
+
+def parse_spilled(line: str):
+    pair, sources = line.rsplit(',', 1)
+    cp = clonepair(pair)
+    cp.sources = int(sources)
+    return cp
+
+def shrink_spilled(block: spilledblock, threshold: float, progress: progressbar, out: writebatch, output: stagequeue,
+                   max_pairs: int, batch_size: int):
+    axis = block.stats.axis()
+    sort_spilled(block.fn, axis, max_pairs * pair_size)
+    duplicates = 0
+    nested = 0
+    
+    def reject(cp1: clonepair, window):
+        nonlocal duplicates, nested
+        for cp2 in window:
+            if clonepair.duplicate(cp1, cp2, threshold=threshold):
+                cp2.sources |= cp1.sources
+                duplicates += 1
+                return True
+            if clonepair.nested(cp1, cp2):
+                nested += 1
+                return True
+        return False
+    
+    def emit(kept: list[clonepair]):
+        # Pairs are written only after they leave the window, when their sources can't change
+        out.extend(kept)
+        if len(out) >= batch_size:
+            output.put(out.take())
+    
+    sweep_spilled(block.fn, parse_spilled, axis, max_pairs, reject, emit, progress)
+    return ([], duplicates, nested, block.size)
+
+def read_blocks(streams: list, sources: int, exact: bool, max_pairs: int, reorder: bool):
+    items = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=filepair_key)
+    block = []
+    counts = [0] * sources
+    seen = {}
+    dropped = 0
+    prev_filepair = None
+    for curr_filepair, source, cp in items:
+        if curr_filepair != prev_filepair:
+            # End of block with same filepair
+            if block:
+                if isinstance(block, spilledblock):
+                    block.close()
+                elif reorder:
+                    block.sort(key=clonepair.__repr__)
+                yield (prev_filepair, block, counts, dropped)
+            prev_filepair = curr_filepair
+            block = []
+            counts = [0] * sources
+            seen = {}
+            dropped = 0
+        counts[source] += 1
+        if isinstance(block, spilledblock):
+            block.append(cp)
+            continue
+        if exact:
+            # Exact copy of an earlier pair of this block
+            key = (cp.b1.begin, cp.b1.end, cp.b2.begin, cp.b2.end)
+            first = seen.get(key)
+            if first is not None:
+                first.sources |= cp.sources
+                dropped += 1
+                continue
+            seen[key] = cp
+        block.append(cp)
+        if max_pairs is not None and len(block) > max_pairs:
+            # Too big to keep in memory, the rest of the block goes to disk
+            block = spilledblock(block)
+            seen = {}
+    if block:
+        if isinstance(block, spilledblock):
+            block.close()
+        elif reorder:
+            block.sort(key=clonepair.__repr__)
+        yield (prev_filepair, block, counts, dropped)
+
+def save_checkpoint(cfn: str, state: dict):
+    tfn = cfn + '.tmp'
+    with open(tfn, "w") as f:
+        json.dump(dict(state, sources=list(state['sources'].items())), f)
+    os.replace(tfn, cfn)
+
+def load_checkpoint(cfn: str):
+    if not os.path.exists(cfn):
+        return None
+    with open(cfn, "r") as f:
+        state = json.load(f)
+    state['sources'] = {mask: count for mask, count in state['sources']}
+    return state
+
+def write_blocks(ofn: str, blocks: stagequeue, sidecar: str, state: dict, cfn: str, interval: float):
+    mode = "a" if state['output_offset'] > 0 else "w"
+    last_checkpoint = time.time()
+    with open(ofn, mode) as of, open(sidecar or os.devnull, mode) as sf:
+        while True:
+            item = blocks.get()
+            if item is None:
+                break
+            lines, sidecar_lines, progress = item
+            of.writelines(lines)
+            sf.writelines(sidecar_lines)
+            if progress is not None and time.time() - last_checkpoint >= interval:
+                # Everything up to the last received block is written now
+                of.flush()
+                sf.flush()
+                os.fsync(of.fileno())
+                state.update(progress)
+                state['output_offset'] = of.tell()
+                state['sidecar_offset'] = sf.tell() if sidecar else 0
+                save_checkpoint(cfn, state)
+                last_checkpoint = time.time()
 
 def lines_in_file(fn: str):
     with open(fn, "rb") as f:
         num_lines = sum(1 for _ in f)
     return num_lines
 
-def shrink(ifn: str, ofn: str, threshold: float):
-    start = time.time()
-    
+def prepare(ifns: list[str], presorted: list[bool]):
     print("Counting lines... ", end="")
     sys.stdout.flush()
-    total_lines = lines_in_file(ifn)
+    input_lines = [lines_in_file(ifn) for ifn in ifns]
     print("done.")
     sys.stdout.flush()
     
-    print("Sorting each line... ")
-    sys.stdout.flush()
-    tfn = sort_file_order(ifn, total_lines)
-    print("done.")
-    sys.stdout.flush()
+    tfns = []
+    for ifn, lines, sorted_input in zip(ifns, input_lines, presorted):
+        if sorted_input:
+            tfns.append(ifn)
+            continue
+        print(f'Sorting each line of "{ifn}"... ')
+        sys.stdout.flush()
+        tfn = sort_file_order(ifn, lines)
+        print("done.")
+        sys.stdout.flush()
+        
+        print(f'Temporary file: "{tfn}"')
+        
+        print("Sorting all lines... ")
+        sys.stdout.flush()
+        sort_lines(tfn, lines)
+        print("\ndone.")
+        sys.stdout.flush()
+        tfns.append(tfn)
+    return tfns, input_lines
+
+def shrink(ifns: list[str], ofn: str, threshold: float, presorted: list[bool] = None, column: bool = False,
+           sidecar: str = None, resume: bool = False, interval: float = 60, max_memory: int = None, stats: bool = False,
+           queue_size: int = default_queue_size, batch_size: int = default_batch_size,
+           chunk_size: int = default_chunk_size):
+    start = time.time()
+    presorted = presorted or [False] * len(ifns)
     
-    print(f'Temporary file: "{tfn}"')
+    cfn = ofn + '.checkpoint'
+    # Paths are absolute, so a resumed run from another directory or with a relative path matches. max_memory
+    # is compared too: blocks processed on disk may keep other pairs, than the same blocks in memory
+    arguments = {'inputs': [os.path.abspath(ifn) for ifn in ifns], 'threshold': threshold, 'presorted': presorted,
+                 'column': column, 'sidecar': sidecar and os.path.abspath(sidecar), 'max_memory': max_memory}
+    state = load_checkpoint(cfn) if resume else None
+    if resume and state is None:
+        print(f'No checkpoint "{cfn}", starting from the beginning.')
+    if state is not None:
+        if any(state.get(key) != value for key, value in arguments.items()):
+            print(f'Checkpoint "{cfn}" was made with other arguments.')
+            exit(0)
+        missing = [tfn for tfn in state['temporary'] if not os.path.exists(tfn)]
+        if missing:
+            print(f'Temporary file "{missing[0]}" from checkpoint is missing.')
+            exit(0)
+        os.truncate(ofn, state['output_offset'])
+        if sidecar:
+            os.truncate(sidecar, state['sidecar_offset'])
+        print(f'Resuming after file pair "{state["filepair"]}", {sum(state["consumed"])} lines are already processed.')
+    else:
+        tfns, input_lines = prepare(ifns, presorted)
+        state = dict(arguments, temporary=tfns, lines=input_lines, consumed=[0] * len(ifns), filepair=None,
+                     output_offset=0, sidecar_offset=0, duplicates=0, nested=0, total=0, sources={})
+        save_checkpoint(cfn, state)
     
-    print("Sorting all lines... ")
-    sys.stdout.flush()
-    sort_lines(tfn, total_lines)
-    print("\ndone.")
-    sys.stdout.flush()
+    tfns = state['temporary']
+    labels = [os.path.splitext(os.path.basename(ifn))[0] for ifn in ifns]
+    consumed = list(state['consumed'])
+    duplicates = state['duplicates']
+    nested = state['nested']
+    total = state['total']
     
+    progress = progressbar(sum(state['lines']), sum(consumed), 4)
     
-    progress = progressbar(total_lines, 0, 4)
+    max_pairs = None
+    if max_memory is not None:
+        max_pairs, chunk_size, batch_size = split_memory(max_memory, len(tfns), queue_size, chunk_size, batch_size)
     
-    with open(tfn, "r") as f, open(ofn, "w") as of:
-        duplicates = 0
-        nested = 0
-        total = 0
-        
-        block = []
-        prev_filepair = ''
-        for line in f:
-            cp = clonepair(line)
-            curr_filepair = cp.get_filepair()
-            if curr_filepair != prev_filepair:
-                # End of block with same filepair
-                sblock, bduplicates, bnested, btotal = shrink_block(block, threshold, progress)
-                write_block(sblock, of)
-                
-                duplicates += bduplicates
-                nested += bnested
-                total += btotal
-                
-                prev_filepair = curr_filepair
-                block = []
-            block.append(cp)
-        
-        sblock, bduplicates, bnested, btotal = shrink_block(block, threshold, progress)
-        write_block(sblock, of)
-        
-        duplicates += bduplicates
-        nested += bnested
-        total += btotal
+    processing_start = time.time()
+    read_queues = [stagequeue(queue_size) for _ in tfns]
+    write_queue = stagequeue(queue_size)
+    exact = threshold == 1.0
+    # Blocks of several inputs or of a ready shrink.py output are not in the order of sorted lines
+    reorder = len(tfns) > 1 or any(presorted)
+    oversized = []
+    readers = [stage(read_lines, tfn, q, skip, chunk_size) for tfn, q, skip in zip(tfns, read_queues, consumed)]
+    writer = stage(write_blocks, ofn, write_queue, sidecar, state, cfn, interval)
+    for reader in readers:
+        reader.start()
+    writer.start()
+    
+    streams = [read_sorted(tfn, queued_lines(q), i) for i, (tfn, q) in enumerate(zip(tfns, read_queues))]
+    out = writebatch(labels, column, sidecar is not None, state['sources'])
+    filepair = None
+    try:
+        for filepair, block, counts, dropped in read_blocks(streams, len(tfns), exact, max_pairs, reorder):
+            if isinstance(block, spilledblock):
+                sblock, bduplicates, bnested, btotal = shrink_spilled(block, threshold, progress, out, write_queue,
+                                                                      max_pairs, batch_size)
+                oversized.append((block.filepair, block.size + dropped))
+            else:
+                sblock, bduplicates, bnested, btotal = shrink_block(block, threshold, progress, exact)
+            if dropped:
+                progress.add(dropped)
+            
+            duplicates += bduplicates + dropped
+            nested += bnested
+            total += btotal + dropped
+            for i, n in enumerate(counts):
+                consumed[i] += n
+            out.extend(sblock)
+            if len(out) >= batch_size:
+                write_queue.put(out.take({'consumed': list(consumed), 'filepair': ';'.join(filepair),
+                                          'duplicates': duplicates, 'nested': nested, 'total': total}))
+        write_queue.put(out.take({'consumed': list(consumed), 'filepair': ';'.join(filepair) if filepair else state['filepair'],
+                                  'duplicates': duplicates, 'nested': nested, 'total': total}))
+    finally:
+        write_queue.close()
+    for reader in readers:
+        reader.finish()
+    writer.finish()
     progress.end()
+    sources = out.sources
     print(f'Total input:\t{total} pairs\n')
-    print(f'Approved:\t{total - duplicates - nested} pairs ({round((total - duplicates - nested) / total * 100, 5)}%)')
-    print(f'Duplicates:\t{duplicates} pairs ({round(duplicates / total * 100, 5)}%)')
-    print(f'Nested:\t\t{nested} pairs ({round(nested / total * 100, 5)}%)')
+    print(f'Approved:\t{total - duplicates - nested} pairs ({round((total - duplicates - nested) / max(total, 1) * 100, 5)}%)')
+    print(f'Duplicates:\t{duplicates} pairs ({round(duplicates / max(total, 1) * 100, 5)}%)')
+    print(f'Nested:\t\t{nested} pairs ({round(nested / max(total, 1) * 100, 5)}%)')
+    if len(ifns) > 1:
+        print('\nApproved pairs by input files:')
+        for mask, count in sorted(sources.items(), key=lambda x: x[1], reverse=True):
+            print(f'{source_labels(mask, labels)}:\t{count} pairs')
+    if oversized:
+        print('\nBlocks processed on disk (--max-memory):')
+        for filepair, size in oversized:
+            print(f'{filepair}:\t{size} pairs')
+    if stats:
+        write_stats(ofn + '.stats', {
+            'total': total,
+            'approved': total - duplicates - nested,
+            'duplicates': duplicates,
+            'nested': nested,
+            'sources': {source_labels(mask, labels): count for mask, count in sources.items()},
+            'oversized': dict(oversized),
+        })
+    print()
+    print_occupancy(read_queues, write_queue, time.time() - processing_start)
     print(f'\nElapsed time: {round(time.time() - start, 2)} s')
-    os.system(f'rm -f {tfn}')
-                
+    for tfn, sorted_input in zip(tfns, presorted):
+        if not sorted_input:
+            os.remove(tfn)
+    os.remove(cfn)
+
 def help():
     print(helpmsg)
     exit(0)
 
 def main():
     threshold = 1.0
-    ifn = None
-    ofn = None
+    presorted = []
+    column = False
+    sidecar = None
+    resume = False
+    interval = 60
+    max_memory = None
+    stats = False
+    fns = []
     i = 1
     while (i < len(sys.argv)):
         if sys.argv[i] == '-t':
             i += 1
             threshold = float(sys.argv[i])
-        elif ifn is None:
-            ifn = sys.argv[i]
-        elif ofn is None:
-            ofn = sys.argv[i]
+        elif sys.argv[i] == '-s':
+            i += 1
+            fns.append(sys.argv[i])
+            presorted.append(True)
+        elif sys.argv[i] == '-p':
+            column = True
+        elif sys.argv[i] == '-P':
+            i += 1
+            sidecar = sys.argv[i]
+        elif sys.argv[i] == '-c':
+            i += 1
+            interval = float(sys.argv[i])
+        elif sys.argv[i] == '--resume':
+            resume = True
+        elif sys.argv[i] == '--max-memory':
+            i += 1
+            max_memory = parse_size(sys.argv[i])
+        elif sys.argv[i] == '--stats':
+            stats = True
         else:
-            help()
+            fns.append(sys.argv[i])
+            presorted.append(False)
         i += 1
     if threshold <= 0 or threshold > 1:
         print("Threshold must be in [0.0, 1.0] range.")
         exit(0)
-    if ifn is None or ofn is None:
+    if len(fns) < 2 or presorted[-1]:
         help()
-            
-    shrink(ifn, ofn, threshold)
+    
+    shrink(fns[:-1], fns[-1], threshold, presorted[:-1], column, sidecar, resume, interval, max_memory, stats)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
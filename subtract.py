@@ -2,10 +2,17 @@ import sys
 import os
 import time
 import tempfile
+import heapq
+import itertools
+import json
+from pipeline import pair_size, split_memory, stagequeue, stage, read_lines, queued_lines, print_occupancy, \
+    write_stats, parse_size, overlapstats, axis_block, sort_spilled, sweep_spilled, default_queue_size, \
+    default_batch_size, default_chunk_size
 
 helpmsg = \
 '''
-Usage: python subtract.py [-t threshold (default: 1.0)] <input1> <input2> <output>
+Usage: python subtract.py [-t threshold (default: 1.0)] [-c interval (default: 60)] [--resume]
+                          [--max-memory size] [--stats] <input1> <input2> <output>
 
 Вычитает один набор пар клонов из другого (из input1 вычитает input2).
 Пара клонов убирается из input1, если её дубликат есть в input2.
@@ -19,6 +26,26 @@ BigCloneEval:
 - если у двух пар клонов оба соответствующих блока совпадают по
   определению выше, то эти пары клонов считают дубликатами, и одна
   из них удаляется.
+
+Каждые interval секунд состояние обработки сохраняется в файл
+output.checkpoint. С флагом --resume прерванный запуск с теми же
+аргументами (пути файлов сравниваются как абсолютные, --max-memory тоже
+должен совпадать) продолжается с последней сохранённой точки, без
+повторной сортировки.
+
+С флагом --max-memory (например, 2G) память на обработку ограничена
+size байтами: половина отводится на блок с одинаковой парой файлов,
+остальное на очереди чтения и записи. Блоки, которые не помещаются в
+свою половину, обрабатываются на диске
+так же, как без --max-memory: сначала удаляются дубликаты внутри input2,
+затем пары input1, у которых есть дубликат в input2, и наконец дубликаты
+внутри input1. Как и в shrink.py, блок сортируется по началу блоков кода,
+и пары сравниваются только с пересекающимися с ними парами, поэтому из
+двух дубликатов остаётся первый в этом порядке, и при threshold < 1.0
+вывод может немного отличаться от обычного.
+
+С флагом --stats итоговая статистика также записывается в формате JSON
+в файл output.stats (её складывает shard.py combine).
 '''
 
 class progressbar:
@@ -37,12 +64,15 @@ class progressbar:
     def perc(self, val=None):
         if val is None:
             val = self.val
-        return val / self.maxval
+        # Empty inputs, e.g. an empty shard, are done from the start
+        return val / self.maxval if self.maxval > 0 else 1.0
     
     def perc_number(self, val=None):
         return round(self.perc(val) * 100, self.precision)
     
     def eta(self):
+        if self.realval == self.startval:
+            return 0.0
         return round((time.time() - self.starttime) * (self.maxval - self.realval) / (self.realval - self.startval), 2)
     
     def elapsed(self):
@@ -58,9 +88,10 @@ class progressbar:
         sys.stdout.flush()
     
     def update(self, val):
-        if round(self.perc_number(val), self.precision) > round(self.perc_number(), self.precision):
-            curr_time = time.time()
-            if time.time() - self.prevtime > 0.5:
+        # Time is checked first, it is much cheaper than the percents
+        curr_time = time.time()
+        if curr_time - self.prevtime > 0.5:
+            if round(self.perc_number(val), self.precision) > round(self.perc_number(), self.precision):
                 self.val = val
                 self.prevtime = curr_time
                 self.show()
@@ -69,6 +100,10 @@ class progressbar:
         self.realval += 1
         self.update(self.realval)
     
+    def add(self, n: int):
+        self.realval += n
+        self.update(self.realval)
+    
     def end(self):
         self.val = self.maxval
         self.prevtime = time.time()
@@ -112,8 +147,7 @@ class clonepair:
     
     @classmethod
     def from_debug(cls, s: str):
-        filenum = s.split(',')[-1]
-        repr = ','.join(s.split(',')[:-1])
+        repr, filenum = s.rsplit(',', 1)
         return cls(repr, int(filenum))
     
     def debug_print(self):
@@ -127,14 +161,15 @@ class clonepair:
         if p1.b1.is_equal(p2.b1, threshold=threshold) and p1.b2.is_equal(p2.b2, threshold=threshold):
             return True
         return False
-    
+
 
 def sort_lines(ifn: str, total_lines: int):
     td = tempfile.mkdtemp()
     batch_size = 500000
-    total_files = (total_lines + batch_size - 1) // batch_size
+    total_files = max((total_lines + batch_size - 1) // batch_size, 1)
     
     cmd = f'''
+export LC_ALL=C
 split -l {batch_size} "{ifn}" {td}/
 i=0
 for f in {td}/*
@@ -179,8 +214,176 @@ def subtract_blocks(block1: list[clonepair], block2: list[clonepair], threshold:
             result.append(cp)
     return result
 
-def write_block(block: list[clonepair], of):
-    of.writelines([cp.__repr__() + "\n" for cp in block])
+def block_lines(block: list[clonepair]):
+    # Output lines are formatted in the main thread, so the writer only writes them
+    return [cp.__repr__() + "\n" for cp in block]
+
+def read_blocks(lines, max_pairs: int = None):
+    block1 = []
+    block2 = []
+    spilled = None
+    prev_filepair = None
+    for line in lines:
+        cp = clonepair.from_debug(line)
+        curr_filepair = (cp.b1.fn, cp.b2.fn)
+        if curr_filepair != prev_filepair:
+            # End of block with same filepair
+            if spilled is not None:
+                spilled.close()
+                yield (prev_filepair, spilled)
+            elif block1 or block2:
+                yield (prev_filepair, (block1, block2))
+            prev_filepair = curr_filepair
+            block1 = []
+            block2 = []
+            spilled = None
+        if spilled is not None:
+            spilled.append(cp)
+            continue
+        if cp.filenum == 1:
+            block1.append(cp)
+        else:
+            block2.append(cp)
+        if max_pairs is not None and len(block1) + len(block2) > max_pairs:
+            # Too big to keep in memory, the rest of the block goes to disk
+            spilled = spilledblock(block1, block2)
+            block1 = []
+            block2 = []
+    if spilled is not None:
+        spilled.close()
+        yield (prev_filepair, spilled)
+    elif block1 or block2:
+        yield (prev_filepair, (block1, block2))
+
+class spilledblock:
+    def __init__(self, block1: list[clonepair], block2: list[clonepair]):
+        # Pairs of input1 and input2 go to separate files
+        self.files = [tempfile.NamedTemporaryFile(mode="w", delete=False, suffix='.spill') for _ in range(2)]
+        self.fns = [f.name for f in self.files]
+        self.filepair = (block1 or block2)[0].get_filepair()
+        self.size1 = 0
+        self.size2 = 0
+        self.stats = overlapstats()
+        for cp in block1 + block2:
+            self.append(cp)
+    
+    def append(self, cp: clonepair):
+        self.files[cp.filenum - 1].write(cp.debug_print() + '\n')
+        self.stats.add(cp)
+        if cp.filenum == 1:
+            self.size1 += 1
+        else:
+            self.size2 += 1
+    
+    def close(self):
+        for f in self.files:
+            f.close()
+
+def filter_spilled(fn: str, kfn: str, axis: int, max_pairs: int, threshold: float):
+    # Pairs of fn, which have no duplicate in kfn; both files are sorted by sort_spilled.
+    # kfn is read by max_pairs pairs, and every part takes a pass over fn
+    survivors = None
+    with open(kfn, "r") as kf:
+        while True:
+            part = [clonepair.from_debug(line) for line in itertools.islice(kf, max_pairs)]
+            if not part:
+                break
+            tf = tempfile.NamedTemporaryFile(mode="w", delete=False, suffix='.spill')
+            survivors = 0
+            # Pairs of the part, which begin before the current pair and can intersect with it
+            active = {}
+            ends = []
+            i = 0
+            with open(fn, "r") as f:
+                for line in f:
+                    cp = clonepair.from_debug(line)
+                    b = axis_block(cp, axis)
+                    while i < len(part) and axis_block(part[i], axis).begin <= b.begin:
+                        active[i] = part[i]
+                        heapq.heappush(ends, (axis_block(part[i], axis).end, i))
+                        i += 1
+                    while ends and ends[0][0] < b.begin:
+                        del active[heapq.heappop(ends)[1]]
+                    duplicate = any(clonepair.duplicate(cp, xcp, threshold) for xcp in active.values())
+                    # and pairs, which begin inside it
+                    j = i
+                    while not duplicate and j < len(part) and axis_block(part[j], axis).begin <= b.end:
+                        duplicate = clonepair.duplicate(cp, part[j], threshold)
+                        j += 1
+                    if not duplicate:
+                        tf.write(line)
+                        survivors += 1
+            tf.close()
+            os.remove(fn)
+            fn = tf.name
+    return fn, survivors
+
+def subtract_spilled(block: spilledblock, threshold: float, progress: progressbar, output: stagequeue, max_pairs: int,
+                     batch_size: int):
+    axis = block.stats.axis()
+    fn1, fn2 = block.fns
+    for fn in block.fns:
+        sort_spilled(fn, axis, max_pairs * pair_size)
+    
+    def has_duplicate(cp: clonepair, window):
+        return any(clonepair.duplicate(cp, xcp, threshold) for xcp in window)
+    
+    # As in subtract_blocks: duplicates inside input2 are dropped first,
+    # then pairs of input1 are checked against the rest of input2 and shrunk among themselves
+    kept2 = tempfile.NamedTemporaryFile(mode="w", delete=False, suffix='.spill')
+    sweep_spilled(fn2, clonepair.from_debug, axis, max_pairs, has_duplicate,
+                  lambda kept: kept2.writelines([cp.debug_print() + '\n' for cp in kept]))
+    kept2.close()
+    sort_spilled(kept2.name, axis, max_pairs * pair_size)
+    fn1, survivors = filter_spilled(fn1, kept2.name, axis, max_pairs, threshold)
+    os.remove(kept2.name)
+    if survivors is not None:
+        progress.add(block.size1 - survivors)
+    
+    result = []
+    keeped = 0
+    
+    def emit(kept: list[clonepair]):
+        nonlocal result, keeped
+        result += kept
+        if len(result) >= batch_size:
+            output.put((block_lines(result), None))
+            keeped += len(result)
+            result = []
+    
+    sweep_spilled(fn1, clonepair.from_debug, axis, max_pairs, has_duplicate, emit, progress)
+    return result, keeped + len(result)
+
+def save_checkpoint(cfn: str, state: dict):
+    tfn = cfn + '.tmp'
+    with open(tfn, "w") as f:
+        json.dump(state, f)
+    os.replace(tfn, cfn)
+
+def load_checkpoint(cfn: str):
+    if not os.path.exists(cfn):
+        return None
+    with open(cfn, "r") as f:
+        return json.load(f)
+
+def write_blocks(ofn: str, blocks: stagequeue, state: dict, cfn: str, interval: float):
+    mode = "a" if state['output_offset'] > 0 else "w"
+    last_checkpoint = time.time()
+    with open(ofn, mode) as of:
+        while True:
+            item = blocks.get()
+            if item is None:
+                break
+            lines, progress = item
+            of.writelines(lines)
+            if progress is not None and time.time() - last_checkpoint >= interval:
+                # Everything up to the last received block is written now
+                of.flush()
+                os.fsync(of.fileno())
+                state.update(progress)
+                state['output_offset'] = of.tell()
+                save_checkpoint(cfn, state)
+                last_checkpoint = time.time()
 
 def lines_in_file(fn: str):
     with open(fn, "rb") as f:
@@ -190,23 +393,16 @@ def lines_in_file(fn: str):
 def concat_files(ifn1: str, ifn2: str, total_lines: int):
     tf = tempfile.NamedTemporaryFile(mode="w", delete=False)
     progress = progressbar(total_lines, 0, 0)
-    with open(ifn1, "r") as f:
-        for line in f:
-            cp = clonepair(line, 1)
-            tf.write(cp.debug_print() + '\n')
-            progress.increment()
-    with open(ifn2, "r") as f:
-        for line in f:
-            cp = clonepair(line, 2)
-            tf.write(cp.debug_print() + '\n')
-            progress.increment()
+    for filenum, ifn in ((1, ifn1), (2, ifn2)):
+        with open(ifn, "r") as f:
+            for line in f:
+                tf.write(clonepair(line, filenum).debug_print() + '\n')
+                progress.increment()
     progress.end()
     tf.close()
     return tf.name
 
-def subtract(ifn1: str, ifn2: str, ofn: str, threshold: float):
-    start = time.time()
-    
+def prepare(ifn1: str, ifn2: str):
     print("Counting lines... ", end="")
     sys.stdout.flush()
     total_lines1 = lines_in_file(ifn1)
@@ -228,46 +424,106 @@ def subtract(ifn1: str, ifn2: str, ofn: str, threshold: float):
     sort_lines(tfn, total_lines)
     print("\ndone.")
     sys.stdout.flush()
+    return tfn, total_lines1
+
+def subtract(ifn1: str, ifn2: str, ofn: str, threshold: float, resume: bool = False, interval: float = 60,
+             max_memory: int = None, stats: bool = False, queue_size: int = default_queue_size,
+             batch_size: int = default_batch_size, chunk_size: int = default_chunk_size):
+    start = time.time()
     
+    cfn = ofn + '.checkpoint'
+    # Paths are absolute, so a resumed run from another directory or with a relative path matches. max_memory
+    # is compared too: blocks processed on disk may keep other pairs, than the same blocks in memory
+    arguments = {'inputs': [os.path.abspath(ifn1), os.path.abspath(ifn2)], 'threshold': threshold,
+                 'max_memory': max_memory}
+    state = load_checkpoint(cfn) if resume else None
+    if resume and state is None:
+        print(f'No checkpoint "{cfn}", starting from the beginning.')
+    if state is not None:
+        if any(state.get(key) != value for key, value in arguments.items()):
+            print(f'Checkpoint "{cfn}" was made with other arguments.')
+            exit(0)
+        if not os.path.exists(state['temporary']):
+            print(f'Temporary file "{state["temporary"]}" from checkpoint is missing.')
+            exit(0)
+        os.truncate(ofn, state['output_offset'])
+        print(f'Resuming after file pair "{state["filepair"]}", {state["consumed"]} lines are already processed.')
+    else:
+        tfn, total_lines1 = prepare(ifn1, ifn2)
+        state = dict(arguments, temporary=tfn, lines=total_lines1, consumed=0, filepair=None,
+                     output_offset=0, keeped=0, total=0)
+        save_checkpoint(cfn, state)
     
-    progress = progressbar(total_lines1, 0, 4)
+    tfn = state['temporary']
+    consumed = state['consumed']
+    keeped = state['keeped']
+    total = state['total']
     
-    with open(tfn, "r") as f, open(ofn, "w") as of:
-        keeped = 0
-        total = 0
-        
-        block1 = []
-        block2 = []
-        prev_filepair = ''
-        for line in f:
-            cp = clonepair.from_debug(line)
-            curr_filepair = cp.get_filepair()
-            if curr_filepair != prev_filepair:
-                # End of block with same filepair
-                sblock = subtract_blocks(block1, block2, threshold, progress)
-                write_block(sblock, of)
-                keeped += len(sblock)
-                
-                prev_filepair = curr_filepair
-                block1 = []
-                block2 = []
-            if cp.filenum == 1:
-                total += 1
-                block1.append(cp)
+    progress = progressbar(state['lines'], total, 4)
+    
+    max_pairs = None
+    if max_memory is not None:
+        max_pairs, chunk_size, batch_size = split_memory(max_memory, 1, queue_size, chunk_size, batch_size)
+    
+    processing_start = time.time()
+    read_queue = stagequeue(queue_size)
+    write_queue = stagequeue(queue_size)
+    oversized = []
+    reader = stage(read_lines, tfn, read_queue, consumed, chunk_size)
+    writer = stage(write_blocks, ofn, write_queue, state, cfn, interval)
+    reader.start()
+    writer.start()
+    
+    lines = []
+    filepair = None
+    try:
+        for filepair, blocks in read_blocks(queued_lines(read_queue), max_pairs):
+            if isinstance(blocks, spilledblock):
+                # Lines of the previous blocks go first
+                write_queue.put((lines, None))
+                lines = []
+                sblock, bkeeped = subtract_spilled(blocks, threshold, progress, write_queue, max_pairs, batch_size)
+                size1, size2 = blocks.size1, blocks.size2
+                oversized.append((blocks.filepair, size1 + size2))
             else:
-                block2.append(cp)
-        
-        sblock = subtract_blocks(block1, block2, threshold, progress)
-        write_block(sblock, of)
-        keeped += len(sblock)
-        
+                block1, block2 = blocks
+                sblock = subtract_blocks(block1, block2, threshold, progress)
+                bkeeped = len(sblock)
+                size1, size2 = len(block1), len(block2)
+            keeped += bkeeped
+            total += size1
+            consumed += size1 + size2
+            lines.extend(block_lines(sblock))
+            if len(lines) >= batch_size:
+                write_queue.put((lines, {'consumed': consumed, 'filepair': ';'.join(filepair), 'keeped': keeped, 'total': total}))
+                lines = []
+        write_queue.put((lines, {'consumed': consumed, 'filepair': ';'.join(filepair) if filepair else state['filepair'],
+                                 'keeped': keeped, 'total': total}))
+    finally:
+        write_queue.close()
+    reader.finish()
+    writer.finish()
     progress.end()
     print(f'Total lines, before subtracting:\t{total} pairs\n')
-    print(f'Keeped lines:\t\t\t\t{keeped} pairs ({round((keeped) / total * 100, 5)}%)')
-    print(f'Removed lines:\t\t\t\t{total - keeped} pairs ({round((total - keeped) / total * 100, 5)}%)')
+    print(f'Keeped lines:\t\t\t\t{keeped} pairs ({round((keeped) / max(total, 1) * 100, 5)}%)')
+    print(f'Removed lines:\t\t\t\t{total - keeped} pairs ({round((total - keeped) / max(total, 1) * 100, 5)}%)')
+    if oversized:
+        print('\nBlocks processed on disk (--max-memory):')
+        for filepair, size in oversized:
+            print(f'{filepair}:\t{size} pairs')
+    if stats:
+        write_stats(ofn + '.stats', {
+            'total': total,
+            'keeped': keeped,
+            'removed': total - keeped,
+            'oversized': dict(oversized),
+        })
+    print()
+    print_occupancy([read_queue], write_queue, time.time() - processing_start)
     print(f'\nElapsed time: {round(time.time() - start, 2)} s')
-    os.system(f'rm -f {tfn}')
-                
+    os.remove(tfn)
+    os.remove(cfn)
+
 def help():
     print(helpmsg)
     exit(0)
@@ -277,11 +533,25 @@ def main():
     ifn1 = None
     ifn2 = None
     ofn = None
+    resume = False
+    interval = 60
+    max_memory = None
+    stats = False
     i = 1
     while (i < len(sys.argv)):
         if sys.argv[i] == '-t':
             i += 1
             threshold = float(sys.argv[i])
+        elif sys.argv[i] == '-c':
+            i += 1
+            interval = float(sys.argv[i])
+        elif sys.argv[i] == '--resume':
+            resume = True
+        elif sys.argv[i] == '--max-memory':
+            i += 1
+            max_memory = parse_size(sys.argv[i])
+        elif sys.argv[i] == '--stats':
+            stats = True
         elif ifn1 is None:
             ifn1 = sys.argv[i]
         elif ifn2 is None:
@@ -296,8 +566,8 @@ def main():
         exit(0)
     if ifn1 is None or ifn2 is None or ofn is None:
         help()
-            
-    subtract(ifn1, ifn2, ofn, threshold)
+    
+    subtract(ifn1, ifn2, ofn, threshold, resume, interval, max_memory, stats)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file